@@ -0,0 +1,139 @@
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+import polars as pl
+
+import iris
+from benchmarks.synthetic import Universe, make_iris_zip
+from iris import (
+    filter_dois,
+    filter_isbns,
+    filter_pmids,
+    handle_duplicates,
+    read_duplicate_priority,
+    read_iris,
+)
+
+# The priority dicts hardcoded in get_iris_pids before they were moved to
+# data/iris_duplicate_priority.csv
+LEGACY_PRIORITY = {
+    "doi:": {35: 1, 50: 2, 41: 3, 57: 4},
+    "pmid:": {35: 1},
+    "isbn:": {49: 1, 35: 2},
+}
+
+
+def apply_heuristic(group, priority):
+    sorted_group = group.sort(
+        pl.col("iris_type").replace_strict(
+            priority, default=float("inf"), return_dtype=pl.Float64
+        )
+    )
+    return sorted_group.head(1)
+
+
+def legacy_handle_duplicates(df, prefix, priority):
+    filtered_df = df.filter(pl.col("id").str.starts_with(prefix))
+    keep_df = filtered_df.group_by("id").map_groups(
+        lambda group: apply_heuristic(group, priority)
+    )
+    return filtered_df.join(keep_df, on="iris_id", how="anti").select("iris_id")
+
+
+def legacy_drops(dupes_df):
+    return pl.concat(
+        [
+            legacy_handle_duplicates(dupes_df, prefix, priority)
+            for prefix, priority in LEGACY_PRIORITY.items()
+        ]
+    )
+
+
+def vectorized_drops(dupes_df):
+    return handle_duplicates(dupes_df, read_duplicate_priority())
+
+
+def duplicated_pids(iris_path):
+    df = read_iris(iris_path)
+    pids = (
+        pl.concat([filter_dois(df), filter_pmids(df), filter_isbns(df)])
+        .rename({"OWNING_COLLECTION": "iris_type"})
+        .unique("iris_id", keep="first", maintain_order=True)
+    )
+    return pids.filter(pl.col("id").is_duplicated()).sort("id", maintain_order=True)
+
+
+def run(dupes_df, resolver, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        drops = resolver(dupes_df)
+        timings.append(time.perf_counter() - start)
+    return min(timings), drops
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the map_groups and vectorized resolution of the duplicated IRIS IDs"
+    )
+    parser.add_argument(
+        "--items",
+        type=int,
+        default=200_000,
+        help="Number of publications of the synthetic IRIS dump",
+    )
+    parser.add_argument(
+        "--duplicate_share",
+        type=float,
+        default=0.05,
+        help="Share of the IRIS entities duplicating the ID of another one",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of timed runs, the best one is reported",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        iris_path = Path(tmp_dir) / "iris.zip"
+        make_iris_zip(
+            iris_path, Universe(args.items), duplicate_share=args.duplicate_share
+        )
+        # The snapshots of the synthetic dump are removed along with it,
+        # rather than left in the cache of the real dumps
+        snapshot_dir = iris.IRIS_SNAPSHOT_DIR
+        iris.IRIS_SNAPSHOT_DIR = Path(tmp_dir) / "snapshots"
+        try:
+            dupes_df = duplicated_pids(iris_path)
+        finally:
+            iris.IRIS_SNAPSHOT_DIR = snapshot_dir
+
+    print(
+        f"Synthetic IRIS dump: {dupes_df.height} entities sharing "
+        f"{dupes_df['id'].n_unique()} IDs"
+    )
+    results = {}
+    for name, resolver in [
+        ("map_groups", legacy_drops),
+        ("vectorized", vectorized_drops),
+    ]:
+        wall, drops = run(dupes_df, resolver, args.repeat)
+        results[name] = set(drops["iris_id"])
+        print(f"{name:>10}: {wall:8.3f} s, {len(results[name])} entities dropped")
+
+    if results["map_groups"] != results["vectorized"]:
+        print("The two implementations drop different entities!")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
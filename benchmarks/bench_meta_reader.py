@@ -0,0 +1,113 @@
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from zipfile import ZipFile
+
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+import polars as pl
+
+from benchmarks.synthetic import Universe, make_meta_zip
+from oc_meta import read_zip_member
+
+
+def disk_write_bytes():
+    # Only available on Linux, the benchmark falls back to the bytes handed
+    # to the temporary files otherwise
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def read_with_tempfile(zip_path, members):
+    written = 0
+    with ZipFile(zip_path) as zip_file:
+        for member in members:
+            with zip_file.open(member, "r") as file:
+                with tempfile.NamedTemporaryFile() as tf:
+                    written += tf.write(file.read())
+                    tf.flush()
+                    pl.scan_csv(tf.name).select(["id", "title", "type"]).collect()
+    return written
+
+
+def read_in_memory(zip_path, members):
+    for member in members:
+        pl.scan_csv(read_zip_member(zip_path, member)).select(
+            ["id", "title", "type"]
+        ).collect()
+    return 0
+
+
+def run(zip_path, reader, repeat):
+    with ZipFile(zip_path) as zip_file:
+        members = [n for n in zip_file.namelist() if n.endswith(".csv")]
+
+    timings = []
+    for _ in range(repeat):
+        io_start = disk_write_bytes()
+        start = time.perf_counter()
+        written = reader(zip_path, members)
+        timings.append(time.perf_counter() - start)
+        io_end = disk_write_bytes()
+
+    if io_start is not None:
+        written = io_end - io_start
+
+    return min(timings), written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the temporary-file and in-memory readers for zipped Meta CSV files"
+    )
+    parser.add_argument(
+        "--members",
+        type=int,
+        default=200,
+        help="Number of CSV files in the synthetic zip",
+    )
+    parser.add_argument(
+        "--rows", type=int, default=5000, help="Number of rows per CSV file"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of timed runs, the best one is reported",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        zip_path = os.path.join(tmp_dir, "meta.zip")
+        make_meta_zip(
+            zip_path, Universe(args.members * args.rows), rows_per_file=args.rows
+        )
+        with ZipFile(zip_path) as zip_file:
+            uncompressed = sum(i.file_size for i in zip_file.infolist())
+
+        print(
+            f"Synthetic Meta zip: {args.members} members, {uncompressed / 1e6:.1f} MB uncompressed"
+        )
+        for name, reader in [
+            ("tempfile", read_with_tempfile),
+            ("in-memory", read_in_memory),
+        ]:
+            wall, written = run(zip_path, reader, args.repeat)
+            print(
+                f"{name:>10}: {wall:8.3f} s, {uncompressed / 1e6 / wall:8.1f} MB/s, "
+                f"{written / 1e6:8.1f} MB written to disk"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Timed scenarios of the pipeline on synthetic dumps, reporting wall time,
+throughput and peak RSS as JSON so that two commits can be compared.
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+sys.path.append(str(ROOT / "src"))
+sys.path.append(str(ROOT / "scripts"))
+
+from benchmarks.synthetic import make_dumps
+
+
+def _get_iris_pids(dumps_dir):
+    from iris import get_iris_pids
+
+    get_iris_pids(str(dumps_dir / "iris.zip"))
+
+
+def _process_meta_zip(dumps_dir):
+    from oc_meta import process_meta_zip
+
+    process_meta_zip(str(dumps_dir / "meta.zip"), str(dumps_dir / "iris.zip"))
+
+
+def _process_meta_tar(dumps_dir):
+    from oc_meta import process_meta_tar
+
+    process_meta_tar(str(dumps_dir / "meta.tar"), str(dumps_dir / "iris.zip"))
+
+
+def _process_index_dump(dumps_dir):
+    from oc_index import process_index_dump
+
+    process_index_dump(str(dumps_dir / "index.zip"))
+
+
+def _answer_question(number):
+    def answer(dumps_dir):
+        import answer_research_questions
+
+        try:
+            import result_cache
+        except ImportError:
+            # Commits before the answers were cached
+            result_cache = None
+        if result_cache is not None:
+            result_cache.enabled = False
+        getattr(answer_research_questions, f"answer_question_{number}")()
+
+    return answer
+
+
+def _no_inputs(dumps_dir):
+    pass
+
+
+def _iris_in_meta_inputs(dumps_dir):
+    if not Path("data/iris_in_meta/iris_in_meta.parquet").exists():
+        _process_meta_zip(dumps_dir)
+
+
+def _iris_in_index_inputs(dumps_dir):
+    _iris_in_meta_inputs(dumps_dir)
+    if not Path("data/iris_in_index/iris_in_index.parquet").exists():
+        _process_index_dump(dumps_dir)
+
+
+# Scenario name, function, the size key of its input in the dumps summary,
+# and the untimed setup of the datasets it reads, reused when an earlier
+# scenario already created them
+SCENARIOS = [
+    ("get_iris_pids", _get_iris_pids, "iris_items", _no_inputs),
+    ("process_meta_zip", _process_meta_zip, "meta_rows", _no_inputs),
+    ("process_meta_tar", _process_meta_tar, "meta_rows", _no_inputs),
+    (
+        "process_index_dump",
+        _process_index_dump,
+        "citations",
+        _iris_in_meta_inputs,
+    ),
+    ("answer_question_1", _answer_question(1), "iris_items", _iris_in_meta_inputs),
+    ("answer_question_2", _answer_question(2), "iris_items", _iris_in_meta_inputs),
+    ("answer_question_3", _answer_question(3), "citations", _iris_in_index_inputs),
+    ("answer_question_4", _answer_question(4), "citations", _iris_in_index_inputs),
+    ("answer_question_5", _answer_question(5), "citations", _iris_in_index_inputs),
+]
+
+
+def _use_repo(repo):
+    # The benchmarked modules are imported from `repo`, which can be another
+    # checkout than the one of this runner
+    sys.path.insert(0, str(Path(repo) / "scripts"))
+    sys.path.insert(0, str(Path(repo) / "src"))
+
+
+def _prepare_scenario(index, work_dir, dumps_dir, repo):
+    # Runs in its own process, so that it doesn't count in the peak RSS or
+    # warm up the imports of the scenario
+    _use_repo(repo)
+    os.chdir(work_dir)
+    with contextlib.redirect_stdout(sys.stderr):
+        SCENARIOS[index][3](Path(dumps_dir))
+
+
+def _run_scenario(index, work_dir, dumps_dir, repo):
+    # Runs in a fresh process, so that the peak RSS is the scenario's own
+    _use_repo(repo)
+    os.chdir(work_dir)
+    _, func, _, _ = SCENARIOS[index]
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    # Keep stdout for the JSON results
+    with contextlib.redirect_stdout(sys.stderr):
+        func(Path(dumps_dir))
+    wall_time = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+
+    return wall_time, cpu_time, peak_rss
+
+
+def _git_commit(repo):
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=repo,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scale=1.0, scenarios=None, dumps_dir=None, repo=ROOT):
+    repo = Path(repo).resolve()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = Path(tmp_dir)
+        if dumps_dir is None:
+            dumps_dir = work_dir / "dumps"
+        dumps_dir = Path(dumps_dir).resolve()
+
+        summary_path = dumps_dir / "summary.json"
+        if summary_path.exists():
+            with open(summary_path) as f:
+                summary = json.load(f)
+        else:
+            summary = make_dumps(dumps_dir, scale=scale)
+            with open(summary_path, "w") as f:
+                json.dump(summary, f)
+
+        results = []
+        for index, (name, _, size_key, _) in enumerate(SCENARIOS):
+            if scenarios and name not in scenarios:
+                continue
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                executor.submit(
+                    _prepare_scenario, index, work_dir, dumps_dir, repo
+                ).result()
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                wall_time, cpu_time, peak_rss = executor.submit(
+                    _run_scenario, index, work_dir, dumps_dir, repo
+                ).result()
+
+            results.append(
+                {
+                    "name": name,
+                    "wall_time_s": round(wall_time, 4),
+                    "cpu_time_s": round(cpu_time, 4),
+                    "rows": summary[size_key],
+                    "throughput_rows_s": round(summary[size_key] / wall_time, 1),
+                    "peak_rss_mb": round(peak_rss / 1024**2, 1),
+                }
+            )
+            print(
+                f"{name:>20}: {wall_time:8.3f} s, "
+                f"{results[-1]['throughput_rows_s']:12.1f} rows/s, "
+                f"{results[-1]['peak_rss_mb']:8.1f} MB peak RSS",
+                file=sys.stderr,
+            )
+
+    return {
+        "commit": _git_commit(repo),
+        "python": platform.python_version(),
+        "polars": __import__("polars").__version__,
+        "cpu_count": os.cpu_count(),
+        "scale": scale,
+        "dumps": summary,
+        "scenarios": results,
+    }
+
+
+def compare(base_path, new_path):
+    with open(base_path) as f:
+        base = {s["name"]: s for s in json.load(f)["scenarios"]}
+    with open(new_path) as f:
+        new = {s["name"]: s for s in json.load(f)["scenarios"]}
+
+    print(
+        f"{'scenario':>20} {'base (s)':>10} {'new (s)':>10} {'speedup':>8} {'RSS ratio':>10}"
+    )
+    for name in base:
+        if name not in new:
+            continue
+        b, n = base[name], new[name]
+        print(
+            f"{name:>20} {b['wall_time_s']:10.3f} {n['wall_time_s']:10.3f} "
+            f"{b['wall_time_s'] / n['wall_time_s']:8.2f} "
+            f"{n['peak_rss_mb'] / b['peak_rss_mb']:10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline on synthetic dumps"
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Scale factor of the synthetic dumps (default: 1)",
+    )
+    parser.add_argument(
+        "--dumps",
+        type=str,
+        help="Folder of synthetic dumps to reuse (generated there if missing)",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="Scenario to run, can be repeated (default: all)",
+    )
+    parser.add_argument(
+        "--repo",
+        type=str,
+        default=str(ROOT),
+        help="Checkout whose pipeline is benchmarked, e.g. a git worktree of another commit (default: this one)",
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, help="Path of the JSON results (default: stdout)"
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASE", "NEW"),
+        help="Compare two JSON results instead of running",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        report = run_benchmarks(
+            scale=args.scale,
+            scenarios=args.scenario,
+            dumps_dir=args.dumps,
+            repo=args.repo,
+        )
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
@@ -0,0 +1,341 @@
+"""
+Generators of synthetic IRIS, OpenCitations Meta and OpenCitations Index
+dumps, laid out like the real ones, for benchmarking the pipeline without
+the full dumps.
+"""
+
+import argparse
+import csv
+import io
+import random
+import tarfile
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+IRIS_TYPES = [35, 36, 37, 40, 41, 42, 44, 45, 49, 50, 57, 58, 77]
+META_COLUMNS = [
+    "id",
+    "title",
+    "author",
+    "issue",
+    "volume",
+    "venue",
+    "page",
+    "pub_date",
+    "type",
+    "publisher",
+    "editor",
+]
+META_TYPES = ["journal article", "book chapter", "book", "proceedings article"]
+INDEX_COLUMNS = [
+    "id",
+    "citing",
+    "cited",
+    "creation",
+    "timespan",
+    "journal_sc",
+    "author_sc",
+]
+SURNAMES = ["Rossi", "Bianchi", "Russo", "Ferrari", "Esposito", "Romano", "Gallo"]
+WORDS = [
+    "analysis",
+    "of",
+    "the",
+    "effects",
+    "on",
+    "model",
+    "study",
+    "data",
+    "novel",
+    "approach",
+    "bologna",
+    "italian",
+    "review",
+    "for",
+    "a",
+]
+
+
+def _csv_bytes(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+class Universe:
+    """
+    A set of publications shared by the synthetic dumps, so that IRIS, Meta
+    and the Index overlap the way the real dumps do.
+    """
+
+    def __init__(self, size, seed=0):
+        self.rng = random.Random(seed)
+        self.publications = []
+        for n in range(size):
+            self.publications.append(
+                {
+                    "omid": f"omid:br/06{n + 1}",
+                    "doi": (
+                        f"10.{1000 + n % 500}/synth.{n}"
+                        if self.rng.random() < 0.8
+                        else None
+                    ),
+                    "pmid": str(1000000 + n) if self.rng.random() < 0.25 else None,
+                    "isbn": f"97888{n:08d}"[:13] if self.rng.random() < 0.1 else None,
+                    "title": " ".join(self.rng.choices(WORDS, k=8)) + f" {n}",
+                    "author": self.rng.choice(SURNAMES),
+                    "year": self.rng.randint(1990, 2024),
+                }
+            )
+
+
+def _noisy_doi(rng, doi):
+    variant = rng.random()
+    if variant < 0.5:
+        return doi
+    if variant < 0.7:
+        return "https://doi.org/" + doi.upper()
+    if variant < 0.85:
+        return f"DOI: {doi};"
+    if variant < 0.95:
+        return f"{doi} {doi}"
+    return "n/a"
+
+
+def _noisy_pmid(rng, pmid):
+    variant = rng.random()
+    if variant < 0.6:
+        return pmid
+    if variant < 0.8:
+        return "000" + pmid
+    if variant < 0.9:
+        return "PMID:" + pmid
+    return "PMC" + pmid
+
+
+def _noisy_isbn(rng, isbn):
+    variant = rng.random()
+    if variant < 0.5:
+        return isbn
+    if variant < 0.8:
+        return f"{isbn[:3]}-{isbn[3:5]}-{isbn[5:9]}-{isbn[9:12]}-{isbn[12:]}"
+    return f"ISBN {isbn}; ISBN 978{isbn[3:]}"
+
+
+def make_iris_zip(path, universe, coverage=0.6, no_id_share=0.1, duplicate_share=0.05):
+    """
+    Write an IRIS dump with the ODS_L1_IR_ITEM_* CSV files. `coverage` is
+    the share of the universe that is in IRIS, `no_id_share` the share of
+    IRIS items without any identifier and `duplicate_share` the share of
+    publications registered twice, under different types.
+    """
+    rng = random.Random(1)
+    master, identifiers, descriptions, publishers, languages = [], [], [], [], []
+
+    publications = []
+    for publication in universe.publications:
+        if rng.random() < coverage:
+            publications.append(publication)
+            if rng.random() < duplicate_share:
+                publications.append(publication)
+
+    for item_id, publication in enumerate(publications, start=1):
+        iris_type = rng.choice(IRIS_TYPES)
+        master.append(
+            [
+                item_id,
+                iris_type,
+                f"type {iris_type}",
+                publication["year"],
+                publication["title"],
+            ]
+        )
+        if rng.random() < no_id_share:
+            identifiers.append([item_id, None, None, None])
+        else:
+            identifiers.append(
+                [
+                    item_id,
+                    _noisy_doi(rng, publication["doi"]) if publication["doi"] else None,
+                    (
+                        _noisy_isbn(rng, publication["isbn"])
+                        if publication["isbn"]
+                        else None
+                    ),
+                    (
+                        _noisy_pmid(rng, publication["pmid"])
+                        if publication["pmid"]
+                        else None
+                    ),
+                ]
+            )
+        descriptions.append(
+            [item_id, f"{publication['author']}, Mario", rng.randint(1, 8)]
+        )
+        publishers.append([item_id, "Publisher", "Bologna", "IT"])
+        languages.append([item_id, rng.choice(["en", "it"])])
+
+    with ZipFile(path, "w", ZIP_DEFLATED) as zip_file:
+        for name, header, rows in [
+            (
+                "MASTER_ALL",
+                [
+                    "ITEM_ID",
+                    "OWNING_COLLECTION",
+                    "OWNING_COLLECTION_DES",
+                    "DATE_ISSUED_YEAR",
+                    "TITLE",
+                ],
+                master,
+            ),
+            ("IDENTIFIER", ["ITEM_ID", "IDE_DOI", "IDE_ISBN", "IDE_PMID"], identifiers),
+            (
+                "DESCRIPTION",
+                ["ITEM_ID", "DES_ALLPEOPLE", "DES_NUMBEROFAUTHORS"],
+                descriptions,
+            ),
+            (
+                "PUBLISHER",
+                ["ITEM_ID", "PUB_NAME", "PUB_PLACE", "PUB_COUNTRY"],
+                publishers,
+            ),
+            ("LANGUAGE", ["ITEM_ID", "LAN_ISO"], languages),
+        ]:
+            zip_file.writestr(f"ODS_L1_IR_ITEM_{name}.csv", _csv_bytes(header, rows))
+
+    return len(master)
+
+
+def _meta_members(universe, rows_per_file):
+    rng = random.Random(2)
+    rows = []
+    for publication in universe.publications:
+        ids = [
+            f"{scheme}:{publication[scheme]}"
+            for scheme in ["doi", "pmid", "isbn"]
+            if publication[scheme]
+        ]
+        rng.shuffle(ids)
+        rows.append(
+            [
+                " ".join([publication["omid"]] + ids),
+                publication["title"],
+                f"{publication['author']}, Mario [omid:ra/06{rng.randint(1, 10**6)}]",
+                "",
+                "",
+                "Journal of Synthetic Data [issn:1234-5678]",
+                "1-10",
+                f"{publication['year']}-01-01",
+                rng.choice(META_TYPES),
+                "",
+                "",
+            ]
+        )
+        if len(rows) == rows_per_file:
+            yield _csv_bytes(META_COLUMNS, rows)
+            rows = []
+    if rows:
+        yield _csv_bytes(META_COLUMNS, rows)
+
+
+def make_meta_zip(path, universe, rows_per_file=2000):
+    """
+    Write a Meta dump as a zip of CSV files, returning the number of files.
+    """
+    with ZipFile(path, "w", ZIP_DEFLATED) as zip_file:
+        for n, data in enumerate(_meta_members(universe, rows_per_file)):
+            zip_file.writestr(f"csv/{n:05d}.csv", data)
+
+    return n + 1
+
+
+def make_meta_tar(path, universe, rows_per_file=2000):
+    """
+    Write a Meta dump as a tar of CSV files, returning the number of files.
+    """
+    with tarfile.open(path, "w") as tar:
+        for n, data in enumerate(_meta_members(universe, rows_per_file)):
+            info = tarfile.TarInfo(f"csv/{n:05d}.csv")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    return n + 1
+
+
+def make_index_zip(path, universe, citations, archives=4, files_per_archive=4):
+    """
+    Write an Index dump as a zip of stored zip archives of CSV files, with
+    `citations` random citations between publications of the universe.
+    """
+    rng = random.Random(3)
+    per_file = max(1, citations // (archives * files_per_archive))
+    omids = [p["omid"] for p in universe.publications]
+    oci = 0
+
+    with ZipFile(path, "w", ZIP_STORED) as outer:
+        for archive in range(archives):
+            buffer = io.BytesIO()
+            with ZipFile(buffer, "w", ZIP_DEFLATED) as inner:
+                for n in range(files_per_archive):
+                    rows = []
+                    for _ in range(per_file):
+                        oci += 1
+                        rows.append(
+                            [
+                                f"oci:06{oci}-06{oci + 1}",
+                                rng.choice(omids),
+                                rng.choice(omids),
+                                "2020-01-01",
+                                "P1Y",
+                                "no",
+                                "no",
+                            ]
+                        )
+                    inner.writestr(
+                        f"{archive}_{n}.csv", _csv_bytes(INDEX_COLUMNS, rows)
+                    )
+            outer.writestr(f"index_{archive:03d}.zip", buffer.getvalue())
+
+    return oci
+
+
+def make_dumps(output_dir, scale=1.0, seed=0):
+    """
+    Write every synthetic dump to `output_dir`. A scale of 1 amounts to
+    100k publications and 500k citations.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    universe = Universe(int(100_000 * scale), seed=seed)
+
+    return {
+        "iris_items": make_iris_zip(output_dir / "iris.zip", universe),
+        "meta_files": make_meta_zip(output_dir / "meta.zip", universe),
+        "meta_tar_files": make_meta_tar(output_dir / "meta.tar", universe),
+        "meta_rows": len(universe.publications),
+        "citations": make_index_zip(
+            output_dir / "index.zip", universe, int(500_000 * scale)
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic IRIS, Meta and Index dumps"
+    )
+    parser.add_argument("output_dir", help="Folder where the dumps are written")
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Scale factor of the dumps (default: 1)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the generator (default: 0)"
+    )
+    args = parser.parse_args()
+
+    print(make_dumps(args.output_dir, scale=args.scale, seed=args.seed))
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
+import asyncio
 import csv
+import io
+import json
 import argparse
 import sys
 import os
+import shutil
 import polars as pl
+from pathlib import Path
 from typing import List, Dict, Optional
 import time
-import backoff
 import requests
+from requests.adapters import HTTPAdapter
 from requests_cache import CachedSession
 from urllib.parse import urlencode
 import logging
@@ -24,64 +29,269 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Crossref's polite pool, for the requests with a mailto in the User-Agent,
+# allows 10 requests per second and 3 concurrent requests
+CROSSREF_RATE = 10
+CROSSREF_CONCURRENCY = 3
+
+RESULT_SCHEMA = {
+    "item_id": pl.Int64,
+    "matched_title": pl.Utf8,
+    "doi": pl.Utf8,
+    "issn": pl.Utf8,
+    "ambiguous_match": pl.Boolean,
+    "score": pl.Float64,
+}
+
+
+class TokenBucket:
+    """
+    Allow `rate` requests per second, with bursts of at most `capacity`
+    requests. The bucket can be paused, e.g. by a Retry-After header, and
+    then all the requests wait.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def pause(self, delay: float):
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + delay)
+
+    def slow_down(self, rate: float):
+        self.rate = min(self.rate, rate)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now >= self.updated:
+                    self.tokens = min(
+                        self.capacity, self.tokens + (now - self.updated) * self.rate
+                    )
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                else:
+                    await asyncio.sleep(self.updated - now)
+
+
+def _fsync(path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+class ResultWriter:
+    """
+    Buffer the results and write them every `flush_every` processed rows,
+    appended to a CSV or JSONL file or as Parquet parts merged into
+    `output_file` on close. After each flush the data is fsynced and a sidecar checkpoint
+    records the last processed row, so that a search is resumed without
+    reading its output.
+    """
+
+    def __init__(self, output_file: str, flush_every: int = 100):
+        self.output_file = Path(output_file)
+        if self.output_file.suffix not in (".csv", ".jsonl", ".parquet"):
+            raise ValueError(
+                f"Output file '{self.output_file}' must be a .csv, .jsonl or .parquet file"
+            )
+        self.format = self.output_file.suffix[1:]
+        self.parquet = self.format == "parquet"
+        self.checkpoint_path = self.output_file.with_name(
+            self.output_file.name + ".checkpoint.json"
+        )
+        self.parts_dir = self.output_file.with_name(self.output_file.name + ".parts")
+        self.merged_path = self.output_file.with_suffix(".tmp")
+        self.flush_every = flush_every
+
+        self.buffer = []
+        self.unflushed = 0
+        self.checkpoint = self._load_checkpoint()
+
+        if not self.parquet:
+            self.file = open(self.output_file, "ab")
+            # Drop what was written after the last checkpoint
+            self.file.truncate(self.checkpoint["offset"])
+            self.file.seek(self.checkpoint["offset"])
+
+    def _load_checkpoint(self) -> Dict:
+        if not self.checkpoint_path.exists():
+            if self.output_file.exists() or self.parts_dir.exists():
+                raise FileExistsError(
+                    f"Output file '{self.output_file}' already exists but has no checkpoint. Please remove it or choose another path."
+                )
+            return {"last_id": None, "position": -1, "offset": 0, "parts": 0}
+
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.pop("merging", False):
+            # The previous run stopped while replacing the output with its
+            # merged parts, which the checkpoint already counts as written
+            if self.merged_path.exists():
+                os.replace(self.merged_path, self.output_file)
+            self.checkpoint = checkpoint
+            self._save_checkpoint()
+        # Drop the parts written after the last checkpoint
+        for part in self.parts_dir.glob("part-*.parquet"):
+            if int(part.stem.split("-")[1]) >= checkpoint["parts"]:
+                part.unlink()
+        return checkpoint
+
+    def _save_checkpoint(self):
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _encode(self, results: List[Dict]) -> bytes:
+        if self.format == "jsonl":
+            return "".join(json.dumps(result) + "\n" for result in results).encode()
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=list(RESULT_SCHEMA))
+        if self.file.tell() == 0:
+            writer.writeheader()
+        writer.writerows(results)
+        return text.getvalue().encode()
+
+    def write(self, result: Dict):
+        self.buffer.append(result)
+
+    def processed(self, position: int, item_id):
+        """
+        Mark the row at `position` of the input as processed, rows have to
+        be processed in the input order.
+        """
+        self.checkpoint["position"] = position
+        self.checkpoint["last_id"] = item_id
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.buffer and self.parquet:
+            self.parts_dir.mkdir(exist_ok=True)
+            part_path = self.parts_dir / f"part-{self.checkpoint['parts']:05d}.parquet"
+            pl.DataFrame(self.buffer, schema=RESULT_SCHEMA).write_parquet(part_path)
+            _fsync(part_path)
+            self.checkpoint["parts"] += 1
+        elif self.buffer:
+            self.file.write(self._encode(self.buffer))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.checkpoint["offset"] = self.file.tell()
+
+        if self.unflushed:
+            self._save_checkpoint()
+        self.buffer = []
+        self.unflushed = 0
+
+    def close(self):
+        self.flush()
+        if not self.parquet:
+            self.file.close()
+        elif self.checkpoint["parts"]:
+            # Merge the parts into the results of the previous runs
+            sources = sorted(self.parts_dir.glob("part-*.parquet"))
+            if self.output_file.exists():
+                sources.insert(0, self.output_file)
+            merged = pl.read_parquet(sources)
+            merged.write_parquet(self.merged_path)
+            _fsync(self.merged_path)
+            # The checkpoint is updated before the output is replaced, so
+            # that the parts are never merged twice. A resumed run finishes
+            # the replacement instead.
+            self.checkpoint["parts"] = 0
+            self.checkpoint["merging"] = True
+            self._save_checkpoint()
+            os.replace(self.merged_path, self.output_file)
+            del self.checkpoint["merging"]
+            self._save_checkpoint()
+            shutil.rmtree(self.parts_dir)
+
+
 class CrossrefClient:
-    def __init__(self, email: str, output_file: str, cache_expire_after: int = 86400):
+    def __init__(
+        self,
+        email: str,
+        output_file: str,
+        cache_expire_after: int = 86400,
+        base_url: str = "https://api.crossref.org/works",
+        rate: float = CROSSREF_RATE,
+        concurrency: int = CROSSREF_CONCURRENCY,
+        retries: int = 5,
+        flush_every: int = 100,
+    ):
         self.session = CachedSession(
             "crossref_cache", expire_after=cache_expire_after, backend="sqlite"
         )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.headers = {"User-Agent": f"PythonCrossrefClient/1.0 (mailto:{email})"}
-        self.base_url = "https://api.crossref.org/works"
+        self.base_url = base_url
         self.output_file = output_file
 
-        self.last_id = self._load_last()
-
-    def _load_last(self) -> Dict:
-        if os.path.exists(self.output_file):
-            last = pl.read_csv(self.output_file).select(pl.last("item_id")).item()
-            return last
-        return 0
-
-    def _save_result(self, result: Dict):
-        write_header = not os.path.exists(self.output_file)
-
-        with open(self.output_file, "a", newline="\n", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=result.keys())
-
-            if write_header:
-                writer.writeheader()
-
-            writer.writerow(result)
-
-    @backoff.on_exception(
-        backoff.expo,
-        (requests.exceptions.RequestException, requests.exceptions.HTTPError),
-        max_tries=5,
-        max_time=30,
-    )
-    def _make_request(self, url: str, params: Dict) -> Dict:
-        full_url = f"{url}?{urlencode(params)}"
-        logger.info(f"Making request to: {full_url}")
-
-        try:
-            response = self.session.get(url, params=params, headers=self.headers)
-            response.raise_for_status()
-
-            if response.status_code == 429:
-                logger.warning("Rate limited. Backing off...")
-                time.sleep(10)
-                return self._make_request(url, params)
+        self.rate = rate
+        self.concurrency = concurrency
+        self.retries = retries
+        self.flush_every = flush_every
 
-            return response.json()
-
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                logger.warning(f"Resource not found: {url}")
-                return None
-            raise
+    def _get(self, url: str, params: Dict, only_if_cached: bool = False):
+        return self.session.get(
+            url, params=params, headers=self.headers, only_if_cached=only_if_cached
+        )
 
-        except Exception as e:
-            logger.error(f"Error making request: {str(e)}")
-            raise
+    def _retry_delay(self, response, attempt: int) -> float:
+        retry_after = response.headers.get("Retry-After", "") if response else ""
+        return int(retry_after) if retry_after.isdigit() else 2**attempt
+
+    def _follow_rate_limit(self, response):
+        # Crossref tells the current limit of the pool in every response
+        limit = response.headers.get("X-Rate-Limit-Limit", "")
+        interval = response.headers.get("X-Rate-Limit-Interval", "").rstrip("s")
+        if limit.isdigit() and interval.isdigit() and int(interval) > 0:
+            self.bucket.slow_down(int(limit) / int(interval))
+
+    async def _make_request(self, url: str, params: Dict) -> Optional[Dict]:
+        # Cached responses don't count towards the rate limit
+        response = await asyncio.to_thread(self._get, url, params, True)
+        if response.status_code == 504:
+            full_url = f"{url}?{urlencode(params)}"
+            logger.info(f"Making request to: {full_url}")
+
+            for attempt in range(self.retries + 1):
+                await self.bucket.acquire()
+                async with self.semaphore:
+                    try:
+                        response = await asyncio.to_thread(self._get, url, params)
+                    except (requests.ConnectionError, requests.Timeout):
+                        if attempt == self.retries:
+                            raise
+                        response = None
+                if response is not None:
+                    self._follow_rate_limit(response)
+                    if response.status_code != 429 and response.status_code < 500:
+                        break
+                if attempt < self.retries:
+                    delay = self._retry_delay(response, attempt)
+                    logger.warning(f"Rate limited. Backing off for {delay} s...")
+                    self.bucket.pause(delay)
+
+        if response.status_code == 404:
+            logger.warning(f"Resource not found: {url}")
+            return None
+        response.raise_for_status()
+
+        return response.json()
 
     def parse_authors(self, authors: List[Dict]) -> str:
         return ", ".join(
@@ -92,66 +302,121 @@ class CrossrefClient:
             ]
         )
 
-    def search_publications(self, input_df: pl.DataFrame):
-        start_index = input_df["ITEM_ID"].to_list().index(self.last_id)
-        logger.info(f"Starting from index {start_index}")
+    async def _search_publication(self, row) -> Optional[Dict]:
+        item_id = row[0]
+        author = row[6]
+        title = row[9]
 
-        with tqdm(total=len(input_df), initial=start_index, leave=True) as pbar:
-            for row in input_df[start_index + 1 :].iter_rows():
-                item_id = row[0]
-                author = row[6]
-                title = row[9]
+        params = {
+            "query.bibliographic": f"{title}, {author}",
+            "rows": 2,
+            "select": "author,title,DOI,ISSN,score",
+        }
 
-                params = {
-                    "query.bibliographic": f"{title}, {author}",
-                    "rows": 2,
-                    "select": "author,title,DOI,ISSN,score",
+        try:
+            logger.info(f"Searching for {author} - '{title}'")
+            response_data = await self._make_request(self.base_url, params)
+
+            if response_data and "message" in response_data:
+                items = response_data["message"].get("items", [])
+
+                if not items:
+                    logger.info(f"No match found for '{title}'")
+                    return None
+
+                best_match = items[0]
+                logger.info(
+                    f"Found {best_match.get('score')} - "
+                    f"{self.parse_authors(best_match.get('author', []))} - "
+                    f"'{best_match.get('title', [None])[0]}'"
+                )
+
+                ambiguous = len(items) > 1 and items[0].get("score", 0) == items[1].get(
+                    "score", 0
+                )
+
+                return {
+                    "item_id": item_id,
+                    "matched_title": best_match.get("title", [None])[0],
+                    "doi": best_match.get("DOI"),
+                    "issn": (
+                        best_match.get("ISSN", [None])[0]
+                        if "ISSN" in best_match
+                        else None
+                    ),
+                    "ambiguous_match": ambiguous,
+                    "score": best_match.get("score"),
                 }
 
-                try:
-                    logger.info(f"Searching for {author} - '{title}'")
-                    response_data = self._make_request(self.base_url, params)
-
-                    if response_data and "message" in response_data:
-                        items = response_data["message"].get("items", [])
-
-                        if items:
-                            best_match = items[0]
-                            logger.info(
-                                f"Found {best_match.get('score')} - "
-                                f"{self.parse_authors(best_match.get('author', []))} - "
-                                f"'{best_match.get('title', [None])[0]}'"
-                            )
-
-                            ambiguous = len(items) > 1 and items[0].get(
-                                "score", 0
-                            ) == items[1].get("score", 0)
-
-                            result = {
-                                "item_id": item_id,
-                                "matched_title": best_match.get("title", [None])[0],
-                                "doi": best_match.get("DOI"),
-                                "issn": best_match.get("ISSN", [None])[0]
-                                if "ISSN" in best_match
-                                else None,
-                                "ambiguous_match": ambiguous,
-                                "score": best_match.get("score"),
-                            }
-                        else:
-                            logger.info(f"No match found for '{title}'")
-                            continue
-
-                        if best_match.get("score", 0) > 85:
-                            self._save_result(result)
-
-                    pbar.update(1)
-
-                    time.sleep(1)
-
-                except Exception as e:
-                    logger.error(f"Error processing '{title}': {str(e)}")
-                    pbar.update(1)
+        except Exception as e:
+            logger.error(f"Error processing '{title}': {str(e)}")
+
+        return None
+
+    async def _search_publications(self, rows, start_index, writer, pbar):
+        self.bucket = TokenBucket(self.rate)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        # The searches are started ahead of the results being saved, which
+        # happens in the input order so that the checkpoint can be resumed
+        pending = []
+        try:
+            for position, row in enumerate(rows, start_index):
+                pending.append(
+                    (
+                        position,
+                        row[0],
+                        asyncio.ensure_future(self._search_publication(row)),
+                    )
+                )
+                if len(pending) < self.concurrency * 4:
                     continue
+                position, item_id, task = pending.pop(0)
+                self._handle_result(position, item_id, await task, writer, pbar)
+            while pending:
+                position, item_id, task = pending.pop(0)
+                self._handle_result(position, item_id, await task, writer, pbar)
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+
+    def _handle_result(self, position, item_id, result, writer, pbar):
+        if result and result["score"] and result["score"] > 85:
+            writer.write(result)
+        writer.processed(position, item_id)
+        pbar.update(1)
+
+    def _resume_index(self, input_df: pl.DataFrame, checkpoint: Dict) -> int:
+        position = checkpoint["position"]
+        if position < 0:
+            return 0
+        if (
+            position < len(input_df)
+            and input_df["ITEM_ID"][position] == checkpoint["last_id"]
+        ):
+            return position + 1
+        # The input changed since the checkpoint, look the last ID up instead
+        position = input_df["ITEM_ID"].index_of(checkpoint["last_id"])
+        if position is None:
+            raise ValueError(
+                f"Last processed item {checkpoint['last_id']} is not in the input"
+            )
+        return position + 1
+
+    def search_publications(self, input_df: pl.DataFrame):
+        writer = ResultWriter(self.output_file, self.flush_every)
+        start_index = self._resume_index(input_df, writer.checkpoint)
+        logger.info(f"Starting from index {start_index}")
+
+        try:
+            with tqdm(total=len(input_df), initial=start_index, leave=True) as pbar:
+                asyncio.run(
+                    self._search_publications(
+                        input_df[start_index:].iter_rows(), start_index, writer, pbar
+                    )
+                )
+        finally:
+            writer.close()
 
 
 def main():
@@ -159,13 +424,38 @@ def main():
         description="Search for publications using Crossref API"
     )
     parser.add_argument(
-        "output_file", help="Output CSV file path", default="crossref_results.csv"
+        "output_file",
+        help="Output CSV, JSONL or Parquet file path",
+        default="crossref_results.csv",
     )
     parser.add_argument(
         "input_df",
         help="Input Dataframe path",
         default="../data/iris_no_id/iris_no_id.parquet",
     )
+    parser.add_argument(
+        "--base-url",
+        default="https://api.crossref.org/works",
+        help="Crossref works endpoint (default: https://api.crossref.org/works)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=CROSSREF_RATE,
+        help=f"Maximum number of requests per second (default: {CROSSREF_RATE})",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=CROSSREF_CONCURRENCY,
+        help=f"Maximum number of requests in flight (default: {CROSSREF_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--flush-every",
+        type=int,
+        default=100,
+        help="Number of processed publications between two checkpoints (default: 100)",
+    )
     parser.add_argument(
         "--cache-expire",
         type=int,
@@ -183,6 +473,10 @@ def main():
             email="leonardo.zilli@studio.unibo.it",
             output_file=args.output_file,
             cache_expire_after=args.cache_expire,
+            base_url=args.base_url,
+            rate=args.rate,
+            concurrency=args.concurrency,
+            flush_every=args.flush_every,
         )
 
         logger.info("Starting publication search...")
@@ -5,42 +5,52 @@ import os
 import textwrap
 import polars as pl
 
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from iris_in_meta import get_omids, is_encoded
+import result_cache
+from result_cache import cached_answer
+
 pl.Config.set_tbl_hide_dataframe_shape(True)
 pl.Config.set_tbl_hide_column_names(True)
 pl.Config.set_tbl_hide_column_data_types(True)
 
 
+@cached_answer
 def answer_question_1(iim_path="data/iris_in_meta"):
     iris_in_meta_path = Path(iim_path)
 
     if not iris_in_meta_path.exists():
         return f"Folder '{str(iris_in_meta_path)}' does not exist. Please run the 'meta_to_parquet.py' script first."
 
-    lf_iim = pl.scan_parquet(iris_in_meta_path / "*.parquet")
+    lf_iim = pl.scan_parquet(iris_in_meta_path / "iris_in_meta.parquet")
 
     result = lf_iim.select(pl.len()).collect()
 
     return result
 
 
+@cached_answer
 def answer_question_2(iim_path="data/iris_in_meta"):
     iris_in_meta_path = Path(iim_path)
 
     if not iris_in_meta_path.exists():
         return f"Folder '{str(iris_in_meta_path)}' does not exist. Please run the 'meta_to_parquet.py' script first."
 
-    lf_iim = pl.scan_parquet(iris_in_meta_path / "*.parquet")
+    lf_iim = pl.scan_parquet(iris_in_meta_path / "iris_in_meta.parquet")
 
     result = (
         lf_iim.group_by("iris_type")
         .len()
         .sort("len", descending=True)
-        .collect(streaming=True)
+        .collect(engine="streaming")
     )
 
     return result
 
 
+@cached_answer
 def answer_question_3(iii_path="data/iris_in_index"):
     iii_path = Path(iii_path)
 
@@ -49,12 +59,20 @@ def answer_question_3(iii_path="data/iris_in_index"):
 
     lf_iii = pl.scan_parquet(iii_path / "iris_in_index.parquet")
 
-    result = lf_iii.select(pl.len()).collect(streaming=True)
+    result = lf_iii.select(pl.len()).collect(engine="streaming")
 
     return result
 
 
-def answer_question_4(iim_path="data/iris_in_meta", iii_path="data/iris_in_index"):
+@cached_answer
+def answer_citation_questions(
+    iim_path="data/iris_in_meta", iii_path="data/iris_in_index"
+):
+    """
+    Answer research questions 3, 4 and 5 together, loading the OMIDs of
+    'Iris in Meta' once and scanning 'Iris in Index' a single time.
+    Returns a dict mapping each question number to its answer.
+    """
     iii_path = Path(iii_path)
     iim_path = Path(iim_path)
 
@@ -67,49 +85,50 @@ def answer_question_4(iim_path="data/iris_in_meta", iii_path="data/iris_in_index
 
     lf_iim = pl.scan_parquet(iim_path / "iris_in_meta.parquet")
 
-    oc_omids_list = (lf_iim.select("omid").collect())["omid"].to_list()
+    # Same encoding as the citations, the membership tests then run on a
+    # typed hash set rather than on a list of Python strings
+    oc_omids = get_omids(encoded=is_encoded(lf_iii, "citing"), lf_iim=lf_iim).implode()
+
+    counts = (
+        lf_iii.select(
+            pl.col("citing").is_in(oc_omids).alias("citing_in_iris"),
+            pl.col("cited").is_in(oc_omids).alias("cited_in_iris"),
+        )
+        .select(
+            pl.len().alias("rq3"),
+            (~pl.col("citing_in_iris")).sum().alias("rq4a"),
+            (~pl.col("cited_in_iris")).sum().alias("rq4b"),
+            (pl.col("citing_in_iris") & pl.col("cited_in_iris")).sum().alias("rq5"),
+        )
+        .collect(engine="streaming")
+        .row(0, named=True)
+    )
 
-    rq4a = (
-        lf_iii.select("citing")
-        .filter(~pl.col("citing").is_in(oc_omids_list))
-        .select(pl.len())
-        .collect(streaming=True)
-    ).item()
+    return {
+        3: pl.DataFrame({"len": [counts["rq3"]]}),
+        4: pl.DataFrame({"citing": [counts["rq4a"]], "cited": [counts["rq4b"]]}),
+        5: pl.DataFrame({"len": [counts["rq5"]]}),
+    }
 
-    rq4b = (
-        lf_iii.select("cited")
-        .filter(~pl.col("cited").is_in(oc_omids_list))
-        .select(pl.len())
-        .collect(streaming=True)
-    ).item()
+
+def answer_question_4(iim_path="data/iris_in_meta", iii_path="data/iris_in_index"):
+    answers = answer_citation_questions(iim_path, iii_path)
+    if isinstance(answers, str):
+        return answers
 
     pl.Config.set_tbl_hide_column_names(False)
-    result = pl.DataFrame({"citing": [rq4a], "cited": [rq4b]})
+    result = answers[4]
 
     return result
 
 
 def answer_question_5(iim_path="data/iris_in_meta", iii_path="data/iris_in_index"):
-    iii_path = Path(iii_path)
-    iim_path = Path(iim_path)
-
-    if not iii_path.exists():
-        return f"Folder '{str(iii_path)}' does not exist. Please run the 'index_to_parquet.py' script first."
-    if not iim_path.exists():
-        return f"Folder '{str(iim_path)}' does not exist. Please run the 'meta_to_parquet.py' script first."
-
-    lf_iii = pl.scan_parquet(iii_path / "iris_in_index.parquet")
-
-    lf_iim = pl.scan_parquet(iim_path / "iris_in_meta.parquet")
-
-    oc_omids_list = (lf_iim.select("omid").collect())["omid"].to_list()
-
-    rq5 = lf_iii.select("citing", "cited").filter(
-        pl.col("citing").is_in(oc_omids_list) & pl.col("cited").is_in(oc_omids_list)
-    )
+    answers = answer_citation_questions(iim_path, iii_path)
+    if isinstance(answers, str):
+        return answers
 
     pl.Config.set_tbl_hide_column_names(True)
-    result = rq5.select(pl.len()).collect(streaming=True)
+    result = answers[5]
 
     return result
 
@@ -124,7 +143,15 @@ def main():
         help="The research question number to answer (1-5). If omitted, all questions will be answered.",
     )
 
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        default=False,
+        help="Recompute the answers instead of reusing the cached ones.",
+    )
+
     args = parser.parse_args()
+    result_cache.enabled = not args.no_cache
     term_size = os.get_terminal_size()
 
     if args.research_question:
@@ -242,7 +269,11 @@ def main():
             )
         )
         print("")
-        print(answer_question_3())
+        # Research questions 3, 4 and 5 share a single scan of the Index
+        citation_answers = answer_citation_questions()
+        if isinstance(citation_answers, str):
+            citation_answers = dict.fromkeys([3, 4, 5], citation_answers)
+        print(citation_answers[3])
         print("\n" + "=" * term_size.columns)
         print(
             "{:*^{}}".format(" Research question n. 4 ", os.get_terminal_size().columns)
@@ -254,7 +285,8 @@ def main():
             )
         )
         print("")
-        print(answer_question_4())
+        with pl.Config(tbl_hide_column_names=False):
+            print(citation_answers[4])
         print("\n" + "=" * term_size.columns)
         print(
             "{:*^{}}".format(" Research question n. 5 ", os.get_terminal_size().columns)
@@ -266,7 +298,7 @@ def main():
             )
         )
         print("")
-        print(answer_question_5())
+        print(citation_answers[5])
         print("")
 
 
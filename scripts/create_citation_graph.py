@@ -0,0 +1,38 @@
+import argparse
+
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+
+from citation_graph import build_citation_graph
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the CSR citation graph of the 'Iris in Index' dataset"
+    )
+    parser.add_argument(
+        "--iii_path",
+        type=str,
+        default="data/iris_in_index",
+        help="Path to the folder of the 'Iris in Index' dataset (default: data/iris_in_index)",
+    )
+    parser.add_argument(
+        "--iim_path",
+        type=str,
+        default="data/iris_in_meta",
+        help="Path to the folder of the 'Iris in Meta' dataset (default: data/iris_in_meta)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="data/citation_graph",
+        help="Path to the folder where the citation graph is created (default: data/citation_graph)",
+    )
+
+    args = parser.parse_args()
+    build_citation_graph(
+        iii_path=args.iii_path, iim_path=args.iim_path, graph_path=args.output
+    )
@@ -0,0 +1,63 @@
+import argparse
+
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+
+from citation_similarity import MEASURES, compute_citation_similarity
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute the co-citation and bibliographic coupling strengths between the IRIS items of the citation graph"
+    )
+    parser.add_argument(
+        "--measure",
+        type=str,
+        choices=[*MEASURES, "both"],
+        default="both",
+        help="Strength to compute, 'cocitation', 'coupling' or 'both' (default: both)",
+    )
+    parser.add_argument(
+        "--graph_path",
+        type=str,
+        default="data/citation_graph",
+        help="Path to the folder of the citation graph created by 'create_citation_graph.py' (default: data/citation_graph)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="data/citation_similarity",
+        help="Path to the folder where the strengths are saved (default: data/citation_similarity)",
+    )
+    parser.add_argument(
+        "--min_weight",
+        type=int,
+        default=1,
+        help="Minimum number of shared citing or cited publications of a pair of items (default: 1)",
+    )
+    parser.add_argument(
+        "--top_k",
+        type=int,
+        help="Number of strongest pairs kept for each item (default: all)",
+    )
+    parser.add_argument(
+        "--block_pairs",
+        type=int,
+        default=5_000_000,
+        help="Number of citation paths expanded at a time, which bounds the memory used (default: 5000000)",
+    )
+
+    args = parser.parse_args()
+    measures = MEASURES if args.measure == "both" else [args.measure]
+    for measure in measures:
+        compute_citation_similarity(
+            measure,
+            graph_path=args.graph_path,
+            output_dir=args.output,
+            min_weight=args.min_weight,
+            top_k=args.top_k,
+            block_pairs=args.block_pairs,
+        )
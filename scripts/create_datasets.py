@@ -12,20 +12,67 @@ from oc_meta import (
     create_iris_noid,
 )
 from oc_index import process_index_dump
+from meta_sparql import META_SPARQL_ENDPOINT
+from meta_titles import match_titles_exact
+from title_lsh import match_titles_fuzzy
+from record_linkage import link_noid_records
+import iris
+import profiling
+from profiling import profile_stage
 
 
 def main(args):
+    if args.profile:
+        profiling.enable(top=args.profile_top)
+
+    iris.persist_contexts = args.persist_iris
+
     if args.iris_in_meta:
-        process_meta(args.meta_path, args.iris_path)
+        with profile_stage("iris_in_meta"):
+            process_meta(
+                args.meta_path,
+                args.iris_path,
+                workers=args.workers,
+                resume=args.resume,
+                encoded=args.encode_omids,
+            )
 
     if args.iris_not_in_meta:
-        create_iris_not_in_meta(args.iris_path)
+        with profile_stage("iris_not_in_meta"):
+            create_iris_not_in_meta(args.iris_path)
 
     if args.iris_no_id:
-        create_iris_noid(args.iris_path)
+        with profile_stage("iris_no_id"):
+            create_iris_noid(args.iris_path)
 
     if args.search_for_titles:
-        search_for_titles(args.iris_path)
+        with profile_stage("search_for_titles"):
+            if args.title_matching == "exact":
+                match_titles_exact(
+                    args.iris_path, args.title_index or "data/meta_titles"
+                )
+            elif args.title_matching == "fuzzy":
+                match_titles_fuzzy(
+                    args.iris_path,
+                    args.title_index or "data/meta_titles_lsh",
+                    top_k=args.title_top_k,
+                    threshold=args.title_threshold,
+                )
+            elif args.title_matching == "linkage":
+                link_noid_records(
+                    args.iris_path,
+                    args.meta_path,
+                    top_k=args.title_top_k,
+                    threshold=args.title_threshold,
+                    workers=args.workers,
+                )
+            else:
+                search_for_titles(
+                    args.iris_path,
+                    endpoint=args.sparql_endpoint,
+                    concurrency=args.sparql_concurrency,
+                    resume=args.resume,
+                )
 
     if args.iris_in_index:
         if args.index_path is None:
@@ -33,7 +80,16 @@ def main(args):
                 "Please provide the path to the OpenCitations Index dump folder by specifying the -index argument."
             )
             exit(1)
-        process_index_dump(args.index_path)
+        with profile_stage("iris_in_index"):
+            process_index_dump(
+                args.index_path,
+                engine=args.index_engine,
+                workers=args.workers,
+                max_memory=args.max_memory,
+            )
+
+    if args.profile:
+        profiling.write_report(args.profile)
 
 
 if __name__ == "__main__":
@@ -52,7 +108,7 @@ if __name__ == "__main__":
         "--meta_path",
         type=str,
         required=True,
-        help="Path to the zip file of the OpenCitations Meta dump",
+        help="Path to the zip or tar file of the OpenCitations Meta dump, or to a Meta store created with create_meta_store.py",
     )
     parser.add_argument(
         "-index",
@@ -90,11 +146,104 @@ if __name__ == "__main__":
         help="Create the Iris No ID dataset containing all the entities with no external IDs in IRIS.",
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to process the Meta CSV files and the Index archives (default: 1).",
+    )
+    parser.add_argument(
+        "--max_memory",
+        "--max-memory",
+        type=str,
+        help="Memory budget for the Index archives processed at the same time, e.g. 16G. Archives are started only while their estimated memory fits in it.",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Resume an interrupted Iris In Meta run or title search, skipping the Meta CSV files or the IRIS titles already processed.",
+    )
+
+    parser.add_argument(
+        "--encode_omids",
+        action="store_true",
+        default=False,
+        help="Store the OMIDs of the Iris In Meta dataset as Int64, the Iris In Index dataset then follows the same encoding.",
+    )
+
+    parser.add_argument(
+        "--index_engine",
+        type=str,
+        choices=["polars", "dask"],
+        default="polars",
+        help="Engine used to filter the OpenCitations Index CSV files (default: polars).",
+    )
+
+    parser.add_argument(
+        "--persist_iris",
+        action="store_true",
+        default=False,
+        help="Keep the normalized IRIS IDs and types in 'data/.cache/iris', so that the next runs on the same IRIS dump reuse them.",
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="REPORT",
+        help="Write a JSON profiling report to REPORT with the wall and CPU time, bytes read, rows in and out and peak memory of every stage and of every processed member.",
+    )
+    parser.add_argument(
+        "--profile_top",
+        "--profile-top",
+        type=int,
+        default=0,
+        help="With --profile, run every member under cProfile and keep the pstats dumps of the N slowest ones next to the report (default: 0).",
+    )
+
     parser.add_argument(
         "--search_for_titles",
         action="store_true",
         default=False,
-        help="Search for the entities without an id in IRIS by their title in Meta. WARNING: this will take ~3 hours to complete.",
+        help="Search for the entities without an id in IRIS by their title in Meta.",
+    )
+    parser.add_argument(
+        "--title_matching",
+        type=str,
+        choices=["sparql", "exact", "fuzzy", "linkage"],
+        default="sparql",
+        help="How --search_for_titles matches the titles: 'sparql' queries the Meta SPARQL endpoint, 'exact' joins them offline with a title index created with create_title_index.py, 'fuzzy' queries an LSH title index created with create_title_index.py --lsh, 'linkage' compares the title, authors and publisher with the Meta entities of the same year and first author in the Meta dump (default: sparql).",
+    )
+    parser.add_argument(
+        "--title_index",
+        type=str,
+        help="Path to the Meta title index used by --title_matching exact or fuzzy (default: data/meta_titles or data/meta_titles_lsh).",
+    )
+    parser.add_argument(
+        "--title_top_k",
+        type=int,
+        default=5,
+        help="With --title_matching fuzzy or linkage, maximum number of Meta candidates kept for each IRIS entity (default: 5).",
+    )
+    parser.add_argument(
+        "--title_threshold",
+        type=float,
+        default=0.5,
+        help="With --title_matching fuzzy, minimum estimated Jaccard similarity of the title shingles of a candidate. With --title_matching linkage, minimum score of a candidate (default: 0.5).",
+    )
+    parser.add_argument(
+        "--sparql_endpoint",
+        type=str,
+        default=META_SPARQL_ENDPOINT,
+        help=f"SPARQL endpoint of Meta used by --search_for_titles (default: {META_SPARQL_ENDPOINT}).",
+    )
+    parser.add_argument(
+        "--sparql_concurrency",
+        type=int,
+        default=4,
+        help="Number of SPARQL queries in flight during --search_for_titles (default: 4).",
     )
 
     args = parser.parse_args()
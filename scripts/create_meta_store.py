@@ -0,0 +1,56 @@
+import argparse
+
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+
+from oc_meta import build_meta_store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert the OpenCitations Meta dump into a partitioned Parquet store"
+    )
+    parser.add_argument(
+        "-meta",
+        "--meta_path",
+        type=str,
+        required=True,
+        help="Path to the zip or tar file of the OpenCitations Meta dump",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="data/meta_store",
+        help="Path to the folder where the Meta store is created (default: data/meta_store)",
+    )
+    parser.add_argument(
+        "--buckets",
+        type=int,
+        default=16,
+        help="Number of hash buckets each identifier scheme is partitioned into (default: 16)",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=100,
+        help="Number of Meta CSV files written to the same Parquet file of each partition (default: 100)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to convert the Meta CSV files (default: 1).",
+    )
+
+    args = parser.parse_args()
+    build_meta_store(
+        args.meta_path,
+        store_path=args.output,
+        buckets=args.buckets,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+    )
@@ -0,0 +1,84 @@
+import argparse
+
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+
+from meta_titles import build_title_index
+from title_lsh import build_title_lsh
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build an index of the OpenCitations Meta entities by normalized title"
+    )
+    parser.add_argument(
+        "-meta",
+        "--meta_path",
+        type=str,
+        required=True,
+        help="Path to the zip or tar file of the OpenCitations Meta dump",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Path to the folder where the title index is created (default: data/meta_titles, or data/meta_titles_lsh with --lsh)",
+    )
+    parser.add_argument(
+        "--lsh",
+        action="store_true",
+        default=False,
+        help="Build a MinHash LSH index of the titles for fuzzy matching, instead of the index of the exact normalized titles",
+    )
+    parser.add_argument(
+        "--num_perm",
+        type=int,
+        default=32,
+        help="With --lsh, number of MinHash values of each title (default: 32)",
+    )
+    parser.add_argument(
+        "--bands",
+        type=int,
+        default=8,
+        help="With --lsh, number of bands the MinHash values are split into. More bands find more candidates with a lower similarity (default: 8)",
+    )
+    parser.add_argument(
+        "--shingle_size",
+        type=int,
+        default=5,
+        help="With --lsh, number of characters of the title shingles (default: 5)",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=100,
+        help="Number of Meta CSV files written to the same Parquet file (default: 100)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to read the Meta CSV files (default: 1).",
+    )
+
+    args = parser.parse_args()
+    if args.lsh:
+        build_title_lsh(
+            args.meta_path,
+            index_path=args.output or "data/meta_titles_lsh",
+            num_perm=args.num_perm,
+            bands=args.bands,
+            shingle_size=args.shingle_size,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+        )
+    else:
+        build_title_index(
+            args.meta_path,
+            index_path=args.output or "data/meta_titles",
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+        )
@@ -0,0 +1,271 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from iris_in_meta import decode_omids, encode_omids, get_omids, is_encoded
+
+GRAPH_ARRAYS = [
+    "omids",
+    "in_iris",
+    "out_indptr",
+    "out_indices",
+    "in_indptr",
+    "in_indices",
+    "item_ids",
+    "item_nodes",
+]
+
+
+def _csr(sources, targets, nodes):
+    """
+    Return the (indptr, indices) arrays of the compressed sparse rows of the
+    edges from `sources` to `targets`. The targets of row i are
+    indices[indptr[i] : indptr[i + 1]].
+    """
+    indptr = np.zeros(nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=nodes), out=indptr[1:])
+    return indptr, targets[pl.Series(sources).arg_sort().to_numpy()]
+
+
+def expand_rows(indptr, indices, rows):
+    """
+    Return the neighbors in the compressed sparse rows of each of `rows`,
+    along with the position in `rows` of the row of each neighbor.
+    """
+    starts = indptr[rows]
+    degree = indptr[rows + 1] - starts
+    row_type = np.int32 if len(rows) < 2**31 else np.int64
+    row_positions = np.repeat(np.arange(len(rows), dtype=row_type), degree)
+
+    # The positions of the neighbors in `indices` are the cumulative sum of
+    # ones, jumping at the first neighbor of each row to its start. They are
+    # built in a single array, as there can be many more than the rows.
+    nonempty = degree > 0
+    starts, degree = starts[nonempty], degree[nonempty]
+    positions = np.ones(degree.sum(), dtype=np.int64)
+    if len(positions):
+        jumps = starts.copy()
+        jumps[1:] -= starts[:-1] + degree[:-1] - 1
+        positions[np.cumsum(degree) - degree] = jumps
+        np.cumsum(positions, out=positions)
+
+    return row_positions, indices[positions]
+
+
+def _lookup(sorted_values, values):
+    # Position of each value in the sorted array, -1 when it is missing
+    positions = np.searchsorted(sorted_values, values).clip(
+        max=max(len(sorted_values) - 1, 0)
+    )
+    found = len(sorted_values) > 0 and sorted_values[positions] == values
+    return np.where(found, positions, -1)
+
+
+def build_citation_graph(
+    iii_path="data/iris_in_index",
+    iim_path="data/iris_in_meta",
+    graph_path="data/citation_graph",
+):
+    """
+    Build the citation graph of 'Iris in Index' as compressed sparse rows in
+    both directions, over node ids numbering the OMIDs in ascending order.
+    All the arrays are saved as .npy files to be memory-mapped by
+    CitationGraph, together with the IRIS items of 'Iris in Meta' and their
+    nodes.
+    """
+    iii_file = Path(iii_path) / "iris_in_index.parquet"
+    iim_path = Path(iim_path)
+    if not iii_file.exists():
+        raise FileNotFoundError(
+            f"File '{iii_file}' does not exist. Please create the 'iris_in_index' dataset first"
+        )
+    if not iim_path.exists():
+        raise FileNotFoundError(
+            f"Folder '{iim_path}' does not exist. Please create the 'iris_in_meta' dataset first"
+        )
+    graph_path = Path(graph_path)
+    if graph_path.exists() and any(graph_path.iterdir()):
+        raise FileExistsError(
+            f"Folder '{graph_path}' already exists and is not empty. Please remove it or choose another path."
+        )
+    graph_path.mkdir(parents=True, exist_ok=True)
+
+    # The nodes are the Int64 encoded OMIDs, whatever the encoding of the
+    # datasets
+    lf_iii = pl.scan_parquet(iii_file)
+    encoded = is_encoded(lf_iii, "citing")
+    citing, cited = pl.col("citing"), pl.col("cited")
+    if not encoded:
+        citing, cited = encode_omids(citing), encode_omids(cited)
+    edges = lf_iii.select(citing, cited).collect(engine="streaming")
+
+    omids = pl.concat([edges["citing"], edges["cited"]]).unique().sort().to_numpy()
+    index_dtype = pl.Int32 if len(omids) < 2**31 else pl.Int64
+    # The dense rank of an OMID is its position in the sorted OMIDs, which is
+    # much faster to compute than a binary search of every edge
+    nodes = edges.select(
+        (pl.concat([pl.col("citing"), pl.col("cited")]).rank("dense") - 1).cast(
+            index_dtype
+        )
+    ).to_series()
+    citing = nodes[: edges.height].to_numpy()
+    cited = nodes[edges.height :].to_numpy()
+    del edges, nodes
+
+    arrays = {"omids": omids}
+    arrays["out_indptr"], arrays["out_indices"] = _csr(citing, cited, len(omids))
+    arrays["in_indptr"], arrays["in_indices"] = _csr(cited, citing, len(omids))
+    del citing, cited
+
+    # The title searches write titles_noid.parquet in the same folder
+    lf_iim = pl.scan_parquet(iim_path / "iris_in_meta.parquet")
+    iris_omids = np.sort(get_omids(encoded=True, lf_iim=lf_iim).drop_nulls().to_numpy())
+    arrays["in_iris"] = _lookup(iris_omids, omids) >= 0
+
+    omid = pl.col("omid") if is_encoded(lf_iim) else encode_omids(pl.col("omid"))
+    items = lf_iim.select("iris_id", omid).unique().sort("iris_id", "omid").collect()
+    arrays["item_ids"] = items["iris_id"].to_numpy()
+    arrays["item_nodes"] = _lookup(omids, items["omid"].fill_null(-1).to_numpy())
+
+    for name in GRAPH_ARRAYS:
+        np.save(graph_path / f"{name}.npy", arrays[name])
+    with open(graph_path / "citation_graph.json", "w") as f:
+        json.dump(
+            {
+                "nodes": len(omids),
+                "edges": len(arrays["out_indices"]),
+                "encoded": encoded,
+            },
+            f,
+            indent=2,
+        )
+
+    print(f"Citation graph saved to '{graph_path}'")
+
+
+class CitationGraph:
+    """
+    Query a citation graph created with `build_citation_graph`. The arrays
+    are memory-mapped, so opening the graph reads only its metadata and
+    each query reads only the rows it needs.
+    """
+
+    def __init__(self, graph_path="data/citation_graph"):
+        self.graph_path = Path(graph_path)
+        metadata_path = self.graph_path / "citation_graph.json"
+        if not metadata_path.exists():
+            raise FileNotFoundError(
+                f"Folder '{self.graph_path}' is not a citation graph. Please create it with the 'create_citation_graph.py' script first."
+            )
+
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        self.nodes = metadata["nodes"]
+        self.edges = metadata["edges"]
+        self.encoded = metadata["encoded"]
+
+        for name in GRAPH_ARRAYS:
+            setattr(self, name, np.load(self.graph_path / f"{name}.npy", mmap_mode="r"))
+
+    def node_ids(self, omids):
+        """
+        Return the node ids of the OMIDs, encoded or not, -1 for the OMIDs
+        that are not in the graph.
+        """
+        omids = pl.Series("omid", omids)
+        if omids.dtype == pl.String:
+            omids = omids.to_frame().select(encode_omids(pl.col("omid")))["omid"]
+        return _lookup(self.omids, omids.fill_null(-1).to_numpy())
+
+    def _omids(self, nodes):
+        omids = pl.Series("omid", self.omids[nodes])
+        if self.encoded:
+            return omids
+        return omids.to_frame().select(decode_omids(pl.col("omid")))["omid"]
+
+    def _degree(self, indptr, omids):
+        nodes = self.node_ids(omids)
+        degree = indptr[nodes + 1] - indptr[nodes]
+        return np.where(nodes >= 0, degree, 0)
+
+    def out_degree(self, omids):
+        """
+        Return the number of citations made by each OMID.
+        """
+        return self._degree(self.out_indptr, omids)
+
+    def in_degree(self, omids):
+        """
+        Return the number of citations received by each OMID.
+        """
+        return self._degree(self.in_indptr, omids)
+
+    def references(self, omid):
+        """
+        Return the OMIDs cited by `omid`, once per citation.
+        """
+        (node,) = self.node_ids([omid])
+        if node < 0:
+            return self._omids([])
+        return self._omids(
+            self.out_indices[self.out_indptr[node] : self.out_indptr[node + 1]]
+        )
+
+    def citations(self, omid):
+        """
+        Return the OMIDs citing `omid`, once per citation.
+        """
+        (node,) = self.node_ids([omid])
+        if node < 0:
+            return self._omids([])
+        return self._omids(
+            self.in_indices[self.in_indptr[node] : self.in_indptr[node + 1]]
+        )
+
+    def item_degrees(self):
+        """
+        Return the in-degree and out-degree of each IRIS item of 'Iris in
+        Meta', summed over its OMIDs. Items not in the graph have degree 0.
+        """
+        nodes = np.asarray(self.item_nodes)
+        found = nodes >= 0
+        nodes = nodes.clip(min=0)
+        return (
+            pl.DataFrame(
+                {
+                    "iris_id": self.item_ids,
+                    "in_degree": np.where(
+                        found, self.in_indptr[nodes + 1] - self.in_indptr[nodes], 0
+                    ),
+                    "out_degree": np.where(
+                        found, self.out_indptr[nodes + 1] - self.out_indptr[nodes], 0
+                    ),
+                }
+            )
+            .group_by("iris_id", maintain_order=True)
+            .sum()
+        )
+
+    def top_cited(self, k=10):
+        """
+        Return the `k` IRIS items with the most citations.
+        """
+        return (
+            self.item_degrees()
+            .sort(["in_degree", "iris_id"], descending=[True, False])
+            .head(k)
+        )
+
+    def induced_subgraph(self):
+        """
+        Return the (citing, cited) node ids of the citations between IRIS
+        publications, the ones counted by research question 5.
+        """
+        # Only the rows of the IRIS nodes are read
+        nodes = np.flatnonzero(self.in_iris).astype(self.out_indices.dtype)
+        positions, cited = expand_rows(self.out_indptr, self.out_indices, nodes)
+        citing = nodes[positions]
+        mask = self.in_iris[cited]
+        return citing[mask], cited[mask]
@@ -0,0 +1,186 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from citation_graph import CitationGraph, expand_rows
+
+# The directions of the two steps from an IRIS item to the items it is
+# related to: co-cited items are cited by the same citing publications, and
+# coupled items cite the same cited publications
+MEASURES = {"cocitation": ("in", "out"), "coupling": ("out", "in")}
+SIMILARITY_SCHEMA = pa.schema(
+    [("iris_id", pa.int64()), ("other_iris_id", pa.int64()), ("weight", pa.int64())]
+)
+
+
+def _restrict_targets(indptr, indices, keep, chunk_size=2**20):
+    """
+    Return the compressed sparse rows without the neighbors that are not in
+    `keep`, reading the neighbors `chunk_size` nodes at a time.
+    """
+    nodes = len(indptr) - 1
+    restricted_indptr = np.zeros(nodes + 1, dtype=np.int64)
+    restricted_indices = []
+
+    for start in range(0, nodes, chunk_size):
+        stop = min(start + chunk_size, nodes)
+        bounds = indptr[start : stop + 1] - indptr[start]
+        neighbors = indices[indptr[start] : indptr[stop]]
+        kept = keep[neighbors]
+        cumulative = np.concatenate([[0], np.cumsum(kept)])
+        restricted_indptr[start + 1 : stop + 1] = (
+            cumulative[bounds[1:]] + restricted_indptr[start]
+        )
+        restricted_indices.append(neighbors[kept])
+
+    return restricted_indptr, np.concatenate(restricted_indices or [indices[:0]])
+
+
+def _path_counts(first_indptr, first_indices, second_indptr, chunk_size=2**20):
+    """
+    Return the number of two-step paths from each node, the first step in
+    the first compressed sparse rows and the second in the second ones. The
+    neighbors are read `chunk_size` nodes at a time.
+    """
+    second_degree = np.diff(second_indptr)
+    counts = np.zeros(len(first_indptr) - 1, dtype=np.int64)
+
+    for start in range(0, len(counts), chunk_size):
+        stop = min(start + chunk_size, len(counts))
+        bounds = first_indptr[start : stop + 1] - first_indptr[start]
+        neighbors = first_indices[first_indptr[start] : first_indptr[stop]]
+        cumulative = np.concatenate([[0], np.cumsum(second_degree[neighbors])])
+        counts[start:stop] = cumulative[bounds[1:]] - cumulative[bounds[:-1]]
+
+    return counts
+
+
+def _similarity_block(
+    first, second, items, item_codes, item_nodes, node_items, min_weight, top_k
+):
+    # The matrix product of the block rows, expanded as the two-step paths
+    # between the items and then counted. The pairs of items are counted as
+    # single Int64 keys of their codes.
+    positions, middle = expand_rows(*first, item_nodes)
+    sources = item_codes[positions]
+    positions, targets = expand_rows(*second, middle)
+    sources = sources[positions]
+    positions, others = expand_rows(*node_items, targets)
+    sources = sources[positions]
+    del middle, targets, positions
+
+    keys = sources.astype(np.int64) * len(items) + others
+    keys = keys[sources != others]
+    del sources, others
+    df = (
+        pl.DataFrame({"key": keys})
+        .group_by("key")
+        .len("weight")
+        .filter(pl.col("weight") >= min_weight)
+    )
+    keys = df["key"].to_numpy()
+    df = pl.DataFrame(
+        {
+            "iris_id": items[keys // len(items)],
+            "other_iris_id": items[keys % len(items)],
+            "weight": df["weight"],
+        }
+    ).sort(["iris_id", "weight", "other_iris_id"], descending=[False, True, False])
+    if top_k:
+        df = df.group_by("iris_id", maintain_order=True).head(top_k)
+
+    return df
+
+
+def compute_citation_similarity(
+    measure,
+    graph_path="data/citation_graph",
+    output_dir="data/citation_similarity",
+    min_weight=1,
+    top_k=None,
+    block_pairs=5_000_000,
+):
+    """
+    Compute the co-citation ('cocitation') or bibliographic coupling
+    ('coupling') strength between the IRIS items of a citation graph, the
+    number of publications citing both items or cited by both items.
+
+    The product of the adjacency matrices is computed a block of items at a
+    time, each block expanding to about `block_pairs` two-step paths, and is
+    written to `<output_dir>/<measure>.parquet` before the next one. Only
+    the pairs with a weight of at least `min_weight` are kept, and only the
+    `top_k` strongest of each item when it is set.
+    """
+    if measure not in MEASURES:
+        raise ValueError(
+            f"Unknown measure '{measure}', expected one of {', '.join(MEASURES)}"
+        )
+    graph = CitationGraph(graph_path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # The items found in the graph, sorted by iris_id and numbered by the
+    # codes of their iris_id, and the item codes of each node as compressed
+    # sparse rows
+    found = np.asarray(graph.item_nodes) >= 0
+    item_ids = np.asarray(graph.item_ids)[found]
+    item_nodes = np.asarray(graph.item_nodes)[found]
+    item_starts = np.flatnonzero(np.diff(item_ids, prepend=item_ids[:1] - 1))
+    items = item_ids[item_starts]
+    item_codes = (np.cumsum(np.diff(item_ids, prepend=item_ids[:1]) != 0)).astype(
+        np.int32
+    )
+    node_items_indptr = np.zeros(graph.nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(item_nodes, minlength=graph.nodes), out=node_items_indptr[1:])
+    node_items = (
+        node_items_indptr,
+        item_codes[np.argsort(item_nodes, kind="stable")],
+    )
+
+    # The second step only goes to IRIS publications, whereas a publication
+    # cited by many IRIS items is mostly cited by other publications
+    first_step, second_step = MEASURES[measure]
+    first = (
+        getattr(graph, f"{first_step}_indptr"),
+        getattr(graph, f"{first_step}_indices"),
+    )
+    second = _restrict_targets(
+        getattr(graph, f"{second_step}_indptr"),
+        getattr(graph, f"{second_step}_indices"),
+        np.asarray(graph.in_iris),
+    )
+
+    # Every node of an item falls in the same block, so that its top_k is
+    # taken over all its pairs
+    paths = _path_counts(*first, second[0])[item_nodes]
+    item_paths = np.add.reduceat(paths, item_starts) if len(item_starts) else paths
+    blocks = np.cumsum(item_paths) // block_pairs
+    block_starts = item_starts[np.flatnonzero(np.diff(blocks, prepend=-1))]
+    block_bounds = list(zip(block_starts, [*block_starts[1:], len(item_ids)]))
+
+    output_path = output_dir / f"{measure}.parquet"
+    tmp_path = output_dir / f"{measure}.parquet.tmp"
+
+    with pq.ParquetWriter(tmp_path, SIMILARITY_SCHEMA) as writer:
+        for start, stop in tqdm(block_bounds):
+            df = _similarity_block(
+                first,
+                second,
+                items,
+                item_codes[start:stop],
+                item_nodes[start:stop],
+                node_items,
+                min_weight,
+                top_k,
+            )
+            if not df.is_empty():
+                writer.write_table(df.to_arrow().cast(SIMILARITY_SCHEMA))
+
+    os.replace(tmp_path, output_path)
+
+    print(f"{measure.capitalize()} saved to '{output_path}'")
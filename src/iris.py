@@ -1,8 +1,52 @@
+import hashlib
+import json
+import os
+from functools import cached_property
 from pathlib import Path
 from zipfile import ZipFile
 
 import polars as pl
 
+IRIS_SNAPSHOT_DIR = Path("data/.cache/iris")
+DUPLICATE_PRIORITY_PATH = (
+    Path(__file__).resolve().parents[1] / "data" / "iris_duplicate_priority.csv"
+)
+
+# Set to keep the normalized IRIS IDs and types between runs
+persist_contexts = False
+_contexts = {}
+
+# The columns kept in the Parquet snapshot of every IRIS table
+IRIS_TABLES = {
+    "ODS_L1_IR_ITEM_MASTER_ALL.csv": {
+        "columns": [
+            "ITEM_ID",
+            "OWNING_COLLECTION",
+            "OWNING_COLLECTION_DES",
+            "DATE_ISSUED_YEAR",
+            "TITLE",
+        ],
+    },
+    "ODS_L1_IR_ITEM_IDENTIFIER.csv": {
+        "columns": ["ITEM_ID", "IDE_DOI", "IDE_ISBN", "IDE_PMID"],
+        "dtypes": {
+            "ITEM_ID": pl.Int64,
+            "IDE_DOI": pl.Utf8,
+            "IDE_ISBN": pl.Utf8,
+            "IDE_PMID": pl.Utf8,
+        },
+    },
+    "ODS_L1_IR_ITEM_DESCRIPTION.csv": {
+        "columns": ["ITEM_ID", "DES_ALLPEOPLE", "DES_NUMBEROFAUTHORS"],
+    },
+    "ODS_L1_IR_ITEM_PUBLISHER.csv": {
+        "columns": ["ITEM_ID", "PUB_NAME", "PUB_PLACE", "PUB_COUNTRY"],
+    },
+    "ODS_L1_IR_ITEM_LANGUAGE.csv": {
+        "columns": ["ITEM_ID", "LAN_ISO"],
+    },
+}
+
 
 def _read_csv_from_zip(
     zip_path: Path, filepath: Path, columns=None, dtypes=None
@@ -20,115 +64,163 @@ def _read_csv_from_folder(
     )
 
 
-def read_iris(iris_path, not_filtered=False, no_id=False) -> pl.DataFrame:
-    iris_path = Path(iris_path)
-
-    subfolder = (
+def _iris_subfolder(iris_path):
+    return (
         Path("POSTPROCESS-iris-data-2025-05-27")
         if "2025-05-30" in iris_path.name
         else Path("")
     )
 
-    if not iris_path.exists():
-        raise FileNotFoundError(
-            f"Folder or file '{iris_path}' does not exist. Please download the IRIS dump and place it in the 'data/' folder."
-        )
 
-    def read_csv(filename, columns=None, dtypes=None):
+def _iris_snapshot_dir(iris_path):
+    dump_key = hashlib.sha1(str(iris_path.resolve()).encode()).hexdigest()[:16]
+    return IRIS_SNAPSHOT_DIR / f"{iris_path.stem}-{dump_key}"
+
+
+def _iris_snapshot_path(iris_path, filename):
+    # The snapshot of a table is tied to the size and modification time of the
+    # file it was converted from, a new dump gets a new snapshot
+    source = (
+        iris_path
+        if iris_path.suffix == ".zip"
+        else iris_path / _iris_subfolder(iris_path) / filename
+    )
+    stat = source.stat()
+    table_key = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    return (
+        _iris_snapshot_dir(iris_path)
+        / f"{Path(filename).stem}-{table_key.hexdigest()[:16]}.parquet"
+    )
+
+
+def scan_iris_table(iris_path, filename) -> pl.LazyFrame:
+    """
+    Scan an IRIS table from its Parquet snapshot, converting the CSV file of
+    the dump the first time the table is used.
+    """
+    iris_path = Path(iris_path)
+    snapshot_path = _iris_snapshot_path(iris_path, filename)
+
+    if not snapshot_path.exists():
+        table = IRIS_TABLES[filename]
+        filepath = _iris_subfolder(iris_path) / filename
         if iris_path.suffix == ".zip":
-            return _read_csv_from_zip(
-                iris_path, subfolder / filename, columns=columns, dtypes=dtypes
+            df = _read_csv_from_zip(
+                iris_path, filepath, table["columns"], table.get("dtypes")
             )
         else:
-            return _read_csv_from_folder(
-                iris_path / subfolder, filename, columns=columns, dtypes=dtypes
+            df = _read_csv_from_folder(
+                iris_path, filepath, table["columns"], table.get("dtypes")
             )
 
-    df_iris_master = read_csv(
-        "ODS_L1_IR_ITEM_MASTER_ALL.csv",
-        columns=["ITEM_ID", "OWNING_COLLECTION", "OWNING_COLLECTION_DES"],
-    )
-    df_iris_identifier = read_csv(
-        "ODS_L1_IR_ITEM_IDENTIFIER.csv",
-        columns=["ITEM_ID", "IDE_DOI", "IDE_ISBN", "IDE_PMID"],
-        dtypes={
-            "ITEM_ID": pl.Int64,
-            "IDE_DOI": pl.Utf8,
-            "IDE_ISBN": pl.Utf8,
-            "IDE_PMID": pl.Utf8,
-        },
-    )
+        # Snapshots of an older version of the same file are replaced
+        for old_snapshot in snapshot_path.parent.glob(f"{Path(filename).stem}-*"):
+            old_snapshot.unlink()
 
-    df = df_iris_identifier.join(df_iris_master, on="ITEM_ID", how="inner")
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = snapshot_path.with_suffix(".parquet.tmp")
+        df.write_parquet(tmp_path)
+        os.replace(tmp_path, snapshot_path)
 
-    if not_filtered:
-        return df
+    return pl.scan_parquet(snapshot_path)
 
-    if no_id:
-        df_iris_description = read_csv(
-            "ODS_L1_IR_ITEM_DESCRIPTION.csv",
-            columns=["ITEM_ID", "DES_ALLPEOPLE", "DES_NUMBEROFAUTHORS"],
-        )
-        df_iris_date_author = read_csv(
-            "ODS_L1_IR_ITEM_MASTER_ALL.csv",
-            columns=["ITEM_ID", "DATE_ISSUED_YEAR", "TITLE"],
-        )
-        df_iris_publisher = read_csv(
-            "ODS_L1_IR_ITEM_PUBLISHER.csv",
-            columns=["ITEM_ID", "PUB_NAME", "PUB_PLACE", "PUB_COUNTRY"],
-        )
-        df_iris_language = read_csv(
-            "ODS_L1_IR_ITEM_LANGUAGE.csv", columns=["ITEM_ID", "LAN_ISO"]
-        )
 
-        noid_df = df.filter(
-            pl.col("IDE_DOI").is_null()
-            & pl.col("IDE_ISBN").is_null()
-            & pl.col("IDE_PMID").is_null()
+def _scan_iris_items(iris_path) -> pl.LazyFrame:
+    if not iris_path.exists():
+        raise FileNotFoundError(
+            f"Folder or file '{iris_path}' does not exist. Please download the IRIS dump and place it in the 'data/' folder."
         )
-        for join_df in [
-            df_iris_description,
-            df_iris_date_author,
-            df_iris_publisher,
-            df_iris_language,
-        ]:
-            noid_df = noid_df.join(join_df, on="ITEM_ID", how="left")
 
-        return noid_df
+    # Only the columns used below are read from the snapshots
+    lf_iris_master = scan_iris_table(iris_path, "ODS_L1_IR_ITEM_MASTER_ALL.csv")
+    lf_iris_identifier = scan_iris_table(iris_path, "ODS_L1_IR_ITEM_IDENTIFIER.csv")
+
+    return lf_iris_identifier.join(
+        lf_iris_master.select(
+            ["ITEM_ID", "OWNING_COLLECTION", "OWNING_COLLECTION_DES"]
+        ),
+        on="ITEM_ID",
+        how="inner",
+    )
+
 
-    df_filtered = df.filter(
+def _select_iris_with_ids(lf) -> pl.LazyFrame:
+    return lf.filter(
         pl.col("IDE_DOI").is_not_null()
         | pl.col("IDE_ISBN").is_not_null()
         | pl.col("IDE_PMID").is_not_null()
     ).drop("OWNING_COLLECTION_DES")
 
-    return df_filtered
 
+def _select_iris_noid(lf, iris_path) -> pl.LazyFrame:
+    lf_iris_description = scan_iris_table(iris_path, "ODS_L1_IR_ITEM_DESCRIPTION.csv")
+    lf_iris_date_author = scan_iris_table(
+        iris_path, "ODS_L1_IR_ITEM_MASTER_ALL.csv"
+    ).select(["ITEM_ID", "DATE_ISSUED_YEAR", "TITLE"])
+    lf_iris_publisher = scan_iris_table(iris_path, "ODS_L1_IR_ITEM_PUBLISHER.csv")
+    lf_iris_language = scan_iris_table(iris_path, "ODS_L1_IR_ITEM_LANGUAGE.csv")
 
-def apply_heuristic(group, priority):
-    sorted_group = group.sort(
-        pl.col("iris_type").replace(priority, default=float("inf"))
+    noid_lf = lf.filter(
+        pl.col("IDE_DOI").is_null()
+        & pl.col("IDE_ISBN").is_null()
+        & pl.col("IDE_PMID").is_null()
     )
-    return sorted_group.head(1)
+    for join_lf in [
+        lf_iris_description,
+        lf_iris_date_author,
+        lf_iris_publisher,
+        lf_iris_language,
+    ]:
+        noid_lf = noid_lf.join(join_lf, on="ITEM_ID", how="left")
 
+    return noid_lf
 
-def handle_duplicates(df, prefix, priority=None, exclude_type=None):
-    filtered_df = df.filter(pl.col("id").str.starts_with(prefix))
 
-    if exclude_type is not None:
-        keep_df = filtered_df.filter(pl.col("iris_type") != exclude_type)
+def read_iris(iris_path, not_filtered=False, no_id=False) -> pl.DataFrame:
+    iris_path = Path(iris_path)
+    lf = _scan_iris_items(iris_path)
 
-    if priority:
-        keep_df = filtered_df.group_by("id").map_groups(
-            lambda group: apply_heuristic(group, priority)
-        )
-    else:
-        keep_df = filtered_df.unique("id", keep="first", maintain_order=True)
+    if not_filtered:
+        return lf.collect()
 
-    #if prefix == "pmid:":
-        #keep_df = keep_df.filter(pl.col("iris_type") != 40)
+    if no_id:
+        return _select_iris_noid(lf, iris_path).collect()
 
-    drop_df = filtered_df.join(keep_df, on="iris_id", how="anti").select("iris_id")
+    return _select_iris_with_ids(lf).collect()
+
+
+def read_duplicate_priority(priority_path=DUPLICATE_PRIORITY_PATH) -> pl.DataFrame:
+    """
+    Read the table ranking, for each ID scheme, the IRIS types to keep when
+    several IRIS entities share the same ID. A lower priority wins, the types
+    not listed for a scheme come after the listed ones.
+    """
+    return pl.read_csv(
+        priority_path,
+        schema={"scheme": pl.Utf8, "iris_type": pl.Int64, "priority": pl.Int64},
+    )
+
+
+def handle_duplicates(df, priority) -> pl.DataFrame:
+    """
+    Return the `iris_id` of the entities to drop among the ones sharing the
+    same ID, keeping the first entity with the best priority for each ID.
+    """
+    keep_df = (
+        df.with_columns(pl.col("id").str.extract(r"^(\w+):").alias("scheme"))
+        .join(
+            priority.with_columns(pl.col("iris_type").cast(df.schema["iris_type"])),
+            on=["scheme", "iris_type"],
+            how="left",
+            maintain_order="left",
+        )
+        .sort("priority", nulls_last=True, maintain_order=True)
+        .group_by("id", maintain_order=True)
+        .first()
+    )
+
+    drop_df = df.join(keep_df, on="iris_id", how="anti").select("iris_id")
 
     return drop_df
 
@@ -207,9 +299,11 @@ def filter_isbns(df) -> pl.DataFrame:
     return filtered_isbns
 
 
-def get_iris_pids(iris_path) -> pl.DataFrame:
-    df_filtered = read_iris(iris_path)
-
+def normalize_iris_pids(df_filtered, priority) -> pl.DataFrame:
+    """
+    Normalize the DOIs, PMIDs and ISBNs of the IRIS entities with an ID,
+    keeping one entity for each ID according to the `priority` table.
+    """
     filtered_dois = filter_dois(df_filtered)
     filtered_pmids = filter_pmids(df_filtered)
     filtered_isbns = filter_isbns(df_filtered)
@@ -221,21 +315,11 @@ def get_iris_pids(iris_path) -> pl.DataFrame:
     dois_pmids_isbns_filtered = dois_pmids_isbns_list.unique(
         "iris_id", keep="first", maintain_order=True
     )
-    dpi_dupes_id = (
-        dois_pmids_isbns_filtered.filter(pl.col("id").is_duplicated())
-        .sort("id")
-        .with_columns(pl.col("iris_type"))
-    )#.replace(type_dict))
-
-    doi_priority = {35: 1, 50: 2, 41: 3, 57: 4}
-    pmid_priority = {35: 1}
-    isbn_priority = {49: 1, 35: 2}
-
-    drop_doi = handle_duplicates(dpi_dupes_id, "doi:", priority=doi_priority)
-    drop_pmid = handle_duplicates(dpi_dupes_id, "pmid:", priority=pmid_priority)
-    drop_isbn = handle_duplicates(dpi_dupes_id, "isbn:", priority=isbn_priority)
+    dpi_dupes_id = dois_pmids_isbns_filtered.filter(pl.col("id").is_duplicated()).sort(
+        "id", maintain_order=True
+    )
 
-    all_drops = pl.concat([drop_doi, drop_pmid, drop_isbn])
+    all_drops = handle_duplicates(dpi_dupes_id, priority)
     final_filtered_df = dois_pmids_isbns_filtered.join(
         all_drops, on="iris_id", how="anti"
     )
@@ -243,13 +327,109 @@ def get_iris_pids(iris_path) -> pl.DataFrame:
     return final_filtered_df
 
 
-def get_iris_type_dict(iris_path):
-    iris_df = read_iris(iris_path, not_filtered=True)
-    type_df = (
-        iris_df[["OWNING_COLLECTION", "OWNING_COLLECTION_DES"]]
-        .drop_nulls("OWNING_COLLECTION")
-        .unique("OWNING_COLLECTION")
-    )
-    type_dict = dict(type_df.sort(pl.col("OWNING_COLLECTION")).iter_rows())
+def _iris_fingerprint(iris_path, priority_path):
+    if iris_path.suffix == ".zip":
+        sources = [iris_path]
+    else:
+        folder = iris_path / _iris_subfolder(iris_path)
+        sources = [folder / f for f in IRIS_TABLES if (folder / f).exists()]
+
+    fingerprint = hashlib.sha1(str(iris_path.resolve()).encode())
+    for source in [*sources, priority_path]:
+        stat = source.stat()
+        fingerprint.update(f"{source.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    return fingerprint.hexdigest()[:16]
 
-    return type_dict
+
+class IrisContext:
+    """
+    The tables of an IRIS dump, each read and normalized at most once. With
+    `persist_contexts` set, the normalized IDs and types are also kept next to
+    the IRIS snapshots and reused by the next runs on the same dump.
+    """
+
+    def __init__(self, iris_path, priority_path=DUPLICATE_PRIORITY_PATH):
+        self.iris_path = Path(iris_path)
+        self.priority_path = Path(priority_path)
+        if not self.iris_path.exists():
+            raise FileNotFoundError(
+                f"Folder or file '{self.iris_path}' does not exist. Please download the IRIS dump and place it in the 'data/' folder."
+            )
+        self.fingerprint = _iris_fingerprint(self.iris_path, self.priority_path)
+
+    def _persisted_path(self, name, suffix):
+        return _iris_snapshot_dir(self.iris_path) / f"{name}-{self.fingerprint}{suffix}"
+
+    def _replace_persisted(self, persisted_path):
+        # Only the version of the current dump and priority table is kept
+        name = persisted_path.name.rsplit("-", 1)[0]
+        persisted_path.parent.mkdir(parents=True, exist_ok=True)
+        for old_path in persisted_path.parent.glob(f"{name}-*"):
+            old_path.unlink()
+
+    @cached_property
+    def items(self) -> pl.DataFrame:
+        return read_iris(self.iris_path, not_filtered=True)
+
+    @cached_property
+    def no_id(self) -> pl.DataFrame:
+        return _select_iris_noid(self.items.lazy(), self.iris_path).collect()
+
+    @cached_property
+    def pids(self) -> pl.DataFrame:
+        persisted_path = self._persisted_path("iris_pids", ".parquet")
+        if persist_contexts and persisted_path.exists():
+            return pl.read_parquet(persisted_path)
+
+        pids = normalize_iris_pids(
+            _select_iris_with_ids(self.items.lazy()).collect(),
+            read_duplicate_priority(self.priority_path),
+        )
+
+        if persist_contexts:
+            self._replace_persisted(persisted_path)
+            pids.write_parquet(persisted_path)
+
+        return pids
+
+    @cached_property
+    def type_dict(self) -> dict:
+        persisted_path = self._persisted_path("iris_types", ".json")
+        if persist_contexts and persisted_path.exists():
+            with open(persisted_path) as f:
+                return {int(k): v for k, v in json.load(f).items()}
+
+        type_df = (
+            self.items[["OWNING_COLLECTION", "OWNING_COLLECTION_DES"]]
+            .drop_nulls("OWNING_COLLECTION")
+            .unique("OWNING_COLLECTION")
+        )
+        type_dict = dict(type_df.sort(pl.col("OWNING_COLLECTION")).iter_rows())
+
+        if persist_contexts:
+            self._replace_persisted(persisted_path)
+            with open(persisted_path, "w") as f:
+                json.dump(type_dict, f)
+
+        return type_dict
+
+
+def get_iris_context(iris_path, priority_path=DUPLICATE_PRIORITY_PATH) -> IrisContext:
+    """
+    Return the context of an IRIS dump shared by all the stages of the
+    current process, a new one is created when the dump changes.
+    """
+    iris_path = Path(iris_path)
+    context = IrisContext(iris_path, priority_path)
+    key = (iris_path.resolve(), context.priority_path.resolve(), context.fingerprint)
+
+    return _contexts.setdefault(key, context)
+
+
+def get_iris_pids(iris_path, priority_path=DUPLICATE_PRIORITY_PATH) -> pl.DataFrame:
+    return get_iris_context(iris_path, priority_path).pids
+
+
+def get_iris_type_dict(iris_path):
+    return get_iris_context(iris_path).type_dict
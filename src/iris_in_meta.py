@@ -2,6 +2,32 @@ from pathlib import Path
 
 import polars as pl
 
+OMID_PREFIX = "omid:br/"
+
+
+def encode_omids(expr):
+    """
+    Encode OMIDs such as 'omid:br/0612345' as Int64. A leading 1 is added to
+    the digits so that their leading zeros survive the encoding. Anything
+    that is not a bibliographic resource OMID is encoded as null.
+    """
+    return (
+        expr.str.strip_prefix(OMID_PREFIX)
+        .str.replace("^", "1")
+        .cast(pl.Int64, strict=False)
+    )
+
+
+def decode_omids(expr):
+    """
+    Decode the Int64 OMIDs produced by `encode_omids` back to strings.
+    """
+    return expr.cast(pl.String).str.replace("^1", OMID_PREFIX, literal=False)
+
+
+def is_encoded(lf, column="omid"):
+    return lf.collect_schema()[column] == pl.Int64
+
 
 def read_iris_in_meta():
     iim_path = Path("data/iris_in_meta")
@@ -10,13 +36,23 @@ def read_iris_in_meta():
             f"Folder '{str(iim_path)}' does not exist. Please create the 'iris_in_meta' dataset first"
         )
 
-    metaparquet_files = Path(iim_path) / "*.parquet"
-    lf_iim = pl.scan_parquet(metaparquet_files)
+    # The title searches write titles_noid.parquet in the same folder
+    lf_iim = pl.scan_parquet(iim_path / "iris_in_meta.parquet")
 
     return lf_iim
 
 
-def get_omids_list():
-    omids_list = (read_iris_in_meta().select("omid").collect())["omid"].to_list()
-
-    return omids_list
+def get_omids(encoded=False, lf_iim=None):
+    """
+    Get the unique OMIDs of 'Iris in Meta' as a Series, encoded as Int64 when
+    `encoded` is set, whatever the encoding of the dataset.
+    """
+    if lf_iim is None:
+        lf_iim = read_iris_in_meta()
+    omid = pl.col("omid")
+    if encoded and not is_encoded(lf_iim):
+        omid = encode_omids(omid)
+    elif not encoded and is_encoded(lf_iim):
+        omid = decode_omids(omid)
+
+    return lf_iim.select(omid.unique()).collect()["omid"]
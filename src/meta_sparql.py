@@ -0,0 +1,186 @@
+import asyncio
+import re
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+META_SPARQL_ENDPOINT = "https://opencitations.net/meta/sparql"
+META_ENTITY_PREFIX = "https://w3id.org/oc/meta/"
+
+FABIO = "http://purl.org/spar/fabio/"
+# The Meta types of the classes of the bibliographic resources, the same
+# labels returned by the Meta REST API
+META_TYPES = {
+    FABIO + "Abstract": "abstract",
+    FABIO + "AcademicProceedings": "proceedings",
+    FABIO + "Book": "book",
+    FABIO + "BookChapter": "book chapter",
+    FABIO + "BookSeries": "book series",
+    FABIO + "BookSet": "book set",
+    FABIO + "ComputerProgram": "computer program",
+    FABIO + "DataFile": "dataset",
+    FABIO + "DataManagementPlan": "data management plan",
+    FABIO + "Editorial": "editorial",
+    FABIO + "ExpressionCollection": "book section",
+    FABIO + "Journal": "journal",
+    FABIO + "JournalArticle": "journal article",
+    FABIO + "JournalIssue": "journal issue",
+    FABIO + "JournalVolume": "journal volume",
+    FABIO + "Preprint": "preprint",
+    FABIO + "ProceedingsPaper": "proceedings article",
+    FABIO + "ReferenceBook": "reference book",
+    FABIO + "ReferenceEntry": "reference entry",
+    FABIO + "ReportDocument": "report",
+    FABIO + "RetractionNotice": "retraction notice",
+    FABIO + "Series": "series",
+    FABIO + "SpecificationDocument": "standard",
+    FABIO + "Thesis": "dissertation",
+    FABIO + "WebContent": "web content",
+    "http://purl.org/spar/doco/Part": "book part",
+    "http://purl.org/spar/fr/ReviewVersion": "peer review",
+}
+
+TITLES_QUERY = """
+PREFIX datacite: <http://purl.org/spar/datacite/>
+PREFIX dcterms: <http://purl.org/dc/terms/>
+PREFIX literal: <http://www.essepuntato.it/2010/06/literalreification/>
+PREFIX fabio: <http://purl.org/spar/fabio/>
+SELECT ?title ?entity ?doi ?type
+WHERE {{
+    VALUES ?title {{ {titles} }}
+    ?entity dcterms:title ?title ;
+        a ?type.
+    ?entity datacite:hasIdentifier ?identifier.
+    ?identifier datacite:usesIdentifierScheme datacite:doi.
+    ?identifier literal:hasLiteralValue ?doi.
+FILTER (?type != fabio:Expression)
+}}"""
+
+
+def _sparql_literal(value):
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def titles_query(titles):
+    return TITLES_QUERY.format(titles=" ".join(_sparql_literal(t) for t in titles))
+
+
+def meta_type(type_uri):
+    """
+    Return the Meta type of a class, e.g. 'journal article' for
+    fabio:JournalArticle. Classes not listed in META_TYPES are turned into
+    lowercase words from their local name.
+    """
+    if type_uri in META_TYPES:
+        return META_TYPES[type_uri]
+    local_name = re.split(r"[/#]", type_uri)[-1]
+    return re.sub(r"(?<!^)(?=[A-Z])", " ", local_name).lower()
+
+
+class MetaSparqlClient:
+    """
+    Search the titles of bibliographic resources in the Meta SPARQL endpoint.
+    Titles are searched in batches with a VALUES clause, at most
+    `concurrency` queries are in flight and they share a pooled session.
+    """
+
+    def __init__(
+        self,
+        endpoint=META_SPARQL_ENDPOINT,
+        concurrency=4,
+        apikey=None,
+        retries=3,
+        timeout=120,
+    ):
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = "application/sparql-results+json"
+        if apikey:
+            self.session.headers["authorization"] = apikey
+
+    def close(self):
+        self.session.close()
+
+    def _post(self, query):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(
+                    self.endpoint, data={"query": query}, timeout=self.timeout
+                )
+                if response.status_code != 429 and response.status_code < 500:
+                    break
+                retry_after = response.headers.get("Retry-After", "")
+                delay = int(retry_after) if retry_after.isdigit() else 2**attempt
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                delay = 2**attempt
+            if attempt < self.retries:
+                time.sleep(delay)
+
+        response.raise_for_status()
+        return response.json()["results"]["bindings"]
+
+    async def _search_batch(self, titles):
+        try:
+            bindings = await asyncio.to_thread(self._post, titles_query(titles))
+        except requests.HTTPError as e:
+            # A malformed title makes the whole batch fail, the batch is split
+            # until the title is isolated and skipped
+            if e.response.status_code != 400:
+                raise
+            if len(titles) == 1:
+                return []
+            middle = len(titles) // 2
+            return await self._search_batch(titles[:middle]) + await self._search_batch(
+                titles[middle:]
+            )
+
+        findings = {}
+        for binding in bindings:
+            key = (
+                binding["title"]["value"],
+                binding["entity"]["value"],
+                binding["doi"]["value"],
+            )
+            type_uri = binding["type"]["value"]
+            # Keep a single type per entity, preferring the listed classes
+            if key not in findings or (
+                type_uri in META_TYPES and findings[key] not in META_TYPES
+            ):
+                findings[key] = type_uri
+
+        return [
+            {
+                "title": title,
+                "omid": entity.replace(META_ENTITY_PREFIX, "omid:"),
+                "id": "doi:" + doi,
+                "type": meta_type(type_uri),
+            }
+            for (title, entity, doi), type_uri in findings.items()
+        ]
+
+    async def search(self, batches):
+        """
+        Search each batch of titles, yielding the findings of the batches in
+        the order they were given.
+        """
+        pending = []
+        try:
+            for titles in batches:
+                pending.append(asyncio.ensure_future(self._search_batch(titles)))
+                if len(pending) >= self.concurrency:
+                    yield await pending.pop(0)
+            while pending:
+                yield await pending.pop(0)
+        finally:
+            for task in pending:
+                task.cancel()
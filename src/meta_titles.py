@@ -0,0 +1,128 @@
+import json
+from pathlib import Path
+
+import polars as pl
+
+from oc_meta import (
+    TITLES_SCHEMA,
+    convert_meta_chunks,
+    get_noid_titles,
+    tokenize_meta_ids,
+)
+
+TITLE_INDEX_COLUMNS = ["id", "title", "type"]
+
+
+def normalize_titles(expr):
+    """
+    Case-fold the titles, strip their punctuation and symbols and collapse
+    their whitespace.
+    """
+    return (
+        expr.str.to_lowercase()
+        .str.replace_all(r"[\p{P}\p{S}]", "")
+        .str.replace_all(r"\s+", " ")
+        .str.strip_chars()
+    )
+
+
+def hash_titles(expr):
+    # Polars only guarantees stable hashes within the same version, which is
+    # why the version is recorded in the index metadata
+    return normalize_titles(expr).hash(seed=0).alias("title_hash")
+
+
+def _index_title_chunk(sources, chunk_id, index_path):
+    df = pl.concat(
+        [
+            tokenize_meta_ids(
+                pl.scan_csv(
+                    source,
+                    schema_overrides={c: pl.String for c in TITLE_INDEX_COLUMNS},
+                )
+                .select(TITLE_INDEX_COLUMNS)
+                .drop_nulls("title"),
+                schemes=("doi",),
+            )
+            for source in sources
+        ]
+    ).select(hash_titles(pl.col("title")), "omid", "id", "type")
+
+    df.collect().write_parquet(index_path / f"part-{chunk_id:05d}.parquet")
+
+
+def build_title_index(
+    meta_path, index_path="data/meta_titles", chunk_size=100, workers=1
+):
+    """
+    Build an index of the Meta entities with a DOI by the 64-bit hash of
+    their normalized title, with one (title_hash, omid, id, type) row per
+    DOI of each entity.
+    """
+    index_path = Path(index_path)
+    if index_path.exists() and any(index_path.iterdir()):
+        raise FileExistsError(
+            f"Folder '{index_path}' already exists and is not empty. Please remove it or choose another path."
+        )
+    index_path.mkdir(parents=True, exist_ok=True)
+
+    convert_meta_chunks(
+        meta_path,
+        _index_title_chunk,
+        (index_path,),
+        chunk_size=chunk_size,
+        workers=workers,
+    )
+
+    with open(index_path / "meta_titles.json", "w") as f:
+        json.dump({"polars_version": pl.__version__}, f, indent=2)
+
+    print(f"Meta title index saved to '{index_path}'")
+
+
+def scan_title_index(index_path="data/meta_titles"):
+    index_path = Path(index_path)
+    if not (index_path / "meta_titles.json").exists():
+        raise FileNotFoundError(
+            f"Folder '{index_path}' is not a Meta title index. Please create it with the 'create_title_index.py' script first."
+        )
+
+    with open(index_path / "meta_titles.json") as f:
+        metadata = json.load(f)
+    if metadata["polars_version"] != pl.__version__:
+        raise ValueError(
+            f"Meta title index built with Polars {metadata['polars_version']}, "
+            "its title hashes can't be compared. Please build it again."
+        )
+
+    return pl.scan_parquet(index_path / "*.parquet")
+
+
+def match_titles_exact(iris_path, index_path="data/meta_titles"):
+    """
+    Match the titles of the IRIS entities with no ID with the Meta title
+    index, in a single join on the hash of the normalized titles.
+    """
+    output_dir = Path("data/iris_in_meta")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    titles = get_noid_titles(iris_path).with_columns(hash_titles(pl.col("TITLE")))
+
+    titles_df = (
+        scan_title_index(index_path)
+        .join(titles.lazy(), on="title_hash", how="inner")
+        .select(
+            pl.col("TITLE").alias("title"),
+            "omid",
+            "id",
+            "type",
+            pl.col("ITEM_ID").alias("iris_id"),
+        )
+        .collect(engine="streaming")
+        .cast(TITLES_SCHEMA)
+        .sort(["iris_id", "omid", "id"])
+    )
+
+    titles_df.write_parquet(output_dir / "titles_noid.parquet")
+
+    print(f"Titles No ID saved to '{output_dir}/titles_noid.parquet'")
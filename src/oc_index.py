@@ -1,5 +1,12 @@
+import io
 import os
-from zipfile import ZipFile
+import struct
+import multiprocessing
+import tempfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from zipfile import ZIP_STORED, ZipFile
 import shutil
 
 import argparse
@@ -11,21 +18,325 @@ import polars as pl
 
 import glob
 
+import pyarrow as pa
+import pyarrow.parquet as pq
+
 import dask.dataframe as dd
 from dask.diagnostics import ProgressBar
 
-from iris_in_meta import get_omids_list
+from iris_in_meta import (
+    OMID_PREFIX,
+    encode_omids,
+    get_omids,
+    is_encoded,
+    read_iris_in_meta,
+)
+from profiling import profile_member
 
 ProgressBar().register()
 
+INDEX_COLUMNS = ["id", "citing", "cited"]
+# Peak memory of filtering a CSV file, relative to its uncompressed size
+INDEX_MEMORY_FACTOR = 3
+# Compressed inner archives up to this size are spooled in memory, larger
+# ones to a temporary file
+INDEX_SPOOL_SIZE = 256 * 1024**2
 
-def process_index_dump(index_path):
-    if not os.path.isdir("data/iris_in_meta"):
-        raise FileNotFoundError(
-            "Folder 'data/iris_in_meta' does not exist. Please create the 'iris_in_meta' dataset first"
+
+def _encode_omids_pandas(series):
+    # Same encoding as iris_in_meta.encode_omids, on the pandas partitions
+    return ("1" + series.str.slice(len(OMID_PREFIX))).astype("int64")
+
+
+class _FileWindow(io.RawIOBase):
+    """
+    Read-only, seekable view of the `size` bytes starting at `start` in the
+    file at `path`, used to open a zip stored inside another zip in place.
+    """
+
+    def __init__(self, path, start, size):
+        self._file = open(path, "rb")
+        self._start = start
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self._size - self._pos)
+        if n <= 0:
+            return 0
+        self._file.seek(self._start + self._pos)
+        n = self._file.readinto(memoryview(buffer)[:n])
+        self._pos += n
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+@contextmanager
+def _open_inner_zip(outer_path, outer, info):
+    if info.compress_type == ZIP_STORED:
+        # Stored members are read in place, skipping their local header
+        with open(outer_path, "rb") as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        start = info.header_offset + 30 + name_length + extra_length
+        with _FileWindow(outer_path, start, info.file_size) as window:
+            with ZipFile(window) as inner:
+                yield inner
+    else:
+        # Seeking backwards in a compressed member restarts its
+        # decompression, which reading the central directory and then each
+        # CSV file would do over and over. They are decompressed once
+        # instead.
+        with tempfile.SpooledTemporaryFile(max_size=INDEX_SPOOL_SIZE) as spool:
+            with outer.open(info) as member:
+                shutil.copyfileobj(member, spool, 1024**2)
+            spool.seek(0)
+            with ZipFile(spool) as inner:
+                yield inner
+
+
+@contextmanager
+def _open_index_archive(index_path, archive):
+    if str(index_path).endswith(".zip"):
+        # The inner archives are read straight from the dump, without
+        # extracting them to disk
+        with ZipFile(index_path) as outer:
+            with _open_inner_zip(index_path, outer, outer.getinfo(archive)) as inner:
+                yield inner
+    else:
+        with ZipFile(Path(index_path) / archive) as inner:
+            yield inner
+
+
+def _list_index_archives(index_path, with_costs=False):
+    """
+    List the inner archives of the Index dump along with the memory needed
+    to filter them, estimated from their largest CSV file. The costs are
+    only computed `with_costs`, since opening a compressed inner archive
+    decompresses it, and are None otherwise.
+    """
+    if str(index_path).endswith(".zip"):
+        with ZipFile(index_path) as outer:
+            archives = [n for n in outer.namelist() if n.endswith(".zip")]
+    else:
+        archives = sorted(a for a in os.listdir(index_path) if a.endswith(".zip"))
+
+    if not with_costs:
+        return [(archive, None) for archive in archives]
+
+    costs = []
+    for archive in archives:
+        with _open_index_archive(index_path, archive) as zip_file:
+            costs.append(
+                INDEX_MEMORY_FACTOR
+                * max(
+                    (i.file_size for i in zip_file.infolist()),
+                    default=0,
+                )
+            )
+
+    return list(zip(archives, costs))
+
+
+def parse_memory_size(size):
+    """
+    Parse a memory size such as '512M' or '16G' into bytes.
+    """
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    size = str(size).strip().upper().removesuffix("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+_omids = None
+_encoded = False
+
+
+def _init_index_worker(omids, encoded, polars_threads=None):
+    global _omids, _encoded
+    if polars_threads is not None:
+        os.environ["POLARS_MAX_THREADS"] = str(polars_threads)
+    _omids = omids
+    _encoded = encoded
+
+
+def _filter_index_csv(source):
+    lf = pl.scan_csv(
+        source, schema_overrides={c: pl.String for c in INDEX_COLUMNS}
+    ).select(INDEX_COLUMNS)
+    if _encoded:
+        lf = lf.with_columns(
+            encode_omids(pl.col("citing")), encode_omids(pl.col("cited"))
+        )
+
+    return lf.filter(
+        pl.col("citing").is_in(_omids) | pl.col("cited").is_in(_omids)
+    ).collect()
+
+
+def _filter_index_archive(index_path, archive):
+    dfs = []
+    with _open_index_archive(index_path, archive) as zip_file:
+        for csv_file in zip_file.namelist():
+            if not csv_file.endswith(".csv"):
+                continue
+            info = zip_file.getinfo(csv_file)
+            with profile_member(
+                "iris_in_index",
+                f"{archive}/{csv_file}",
+                bytes_read=info.compress_size,
+            ) as profile:
+                with profile.phase("decompress"), zip_file.open(csv_file) as f:
+                    data = f.read()
+                with profile.phase("filter"):
+                    df = _filter_index_csv(data)
+                profile.set(rows_in=data.count(b"\n") - 1, rows_out=df.height)
+            dfs.append(df)
+
+    return pl.concat(dfs) if dfs else None
+
+
+def _index_schema(encoded=False):
+    omid_type = pa.int64() if encoded else pa.large_string()
+    return pa.schema(
+        [("id", pa.large_string()), ("citing", omid_type), ("cited", omid_type)]
+    )
+
+
+def _process_index_polars(
+    index_path, output_dir, encoded=False, workers=1, max_memory=None
+):
+    # The OMID set is built once and shared by every CSV file
+    omids = get_omids(encoded=encoded).implode()
+    archives = _list_index_archives(
+        index_path, with_costs=workers > 1 and max_memory is not None
+    )
+
+    output_path = output_dir / "iris_in_index.parquet"
+    tmp_path = output_dir / "iris_in_index.parquet.tmp"
+
+    with pq.ParquetWriter(tmp_path, _index_schema(encoded)) as writer:
+
+        def write(df):
+            if df is not None and not df.is_empty():
+                writer.write_table(df.to_arrow().cast(writer.schema))
+
+        if workers <= 1:
+            _init_index_worker(omids, encoded)
+            for archive, _ in tqdm(archives):
+                write(_filter_index_archive(index_path, archive))
+        else:
+            _run_index_archives(
+                index_path, archives, omids, encoded, workers, max_memory, write
+            )
+
+    os.replace(tmp_path, output_path)
+
+
+def _run_index_archives(
+    index_path, archives, omids, encoded, workers, max_memory, write
+):
+    """
+    Filter the archives in a pool of `workers` processes, starting a new one
+    only while the estimated memory of the archives not yet written stays
+    within `max_memory`. That is the archives being filtered, and the
+    results of the finished ones waiting for an earlier archive, since
+    results are written in the order of the archives.
+    """
+    polars_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_index_worker,
+        initargs=(omids, encoded, polars_threads),
+    ) as executor, tqdm(total=len(archives)) as pbar:
+        _run_within_budget(
+            executor,
+            [
+                (cost, _filter_index_archive, index_path, archive)
+                for archive, cost in archives
+            ],
+            workers,
+            max_memory,
+            write,
+            pbar.update,
         )
 
-    # unzip the internal archives
+
+def _run_within_budget(executor, tasks, workers, max_memory, write, progress):
+    """
+    Submit the `(cost, func, *args)` tasks to `executor` and pass their
+    results to `write` in the order of the tasks, `progress(1)` being called
+    as each one finishes. At most `workers` tasks run at a time, and a new
+    one is only submitted while the memory of the tasks not yet written
+    stays within `max_memory`.
+    """
+    ordered = deque()
+    running = set()
+    # Memory of each task not yet written, its estimated cost while it runs
+    # and then the size of its result
+    unwritten = {}
+
+    def finished(future):
+        running.remove(future)
+        progress(1)
+        if future.exception() is None and future.result() is not None:
+            unwritten[future] = future.result().estimated_size()
+
+    def wait_running():
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            finished(future)
+        while ordered and ordered[0].done():
+            future = ordered.popleft()
+            # It can have finished after the wait returned
+            if future in running:
+                finished(future)
+            del unwritten[future]
+            write(future.result())
+
+    for cost, func, *args in tasks:
+        # At least one task is always in flight, even over budget
+        while running and (
+            len(running) >= workers
+            or (max_memory is not None and sum(unwritten.values()) + cost > max_memory)
+        ):
+            wait_running()
+
+        future = executor.submit(func, *args)
+        running.add(future)
+        unwritten[future] = cost or 0
+        ordered.append(future)
+
+    while running:
+        wait_running()
+
+
+def _process_index_dask(index_path, output_dir, encoded=False):
+    # dask reads the inner archives by path, a zipped dump is extracted first
     if index_path.endswith(".zip"):
         extraction_dir = index_path.replace(".zip", "")
         with ZipFile(index_path, "r") as zip_ref:
@@ -36,9 +347,7 @@ def process_index_dump(index_path):
         Path(index_path) / Path(archive) for archive in os.listdir(index_path)
     ]
 
-    omids_list = get_omids_list()
-
-    output_dir = Path("data/iris_in_index")
+    omids_list = get_omids(encoded=encoded).to_list()
 
     for archive in tqdm(file_names):
         zip_file = ZipFile(archive)
@@ -48,8 +357,17 @@ def process_index_dump(index_path):
         ddf = dd.read_csv(
             csvs,
             storage_options={"fo": zip_file.filename},
-            usecols=["id", "citing", "cited"],
+            usecols=INDEX_COLUMNS,
         )
+        if encoded:
+            ddf = ddf.assign(
+                citing=ddf["citing"].map_partitions(
+                    _encode_omids_pandas, meta=("citing", "int64")
+                ),
+                cited=ddf["cited"].map_partitions(
+                    _encode_omids_pandas, meta=("cited", "int64")
+                ),
+            )
         ddf = ddf[ddf["cited"].isin(omids_list) | ddf["citing"].isin(omids_list)]
         ddf.to_parquet(output_dir / archive.stem, write_index=False)
 
@@ -64,6 +382,34 @@ def process_index_dump(index_path):
             shutil.rmtree(item_path)
 
 
+def process_index_dump(index_path, engine="polars", workers=1, max_memory=None):
+    if not os.path.isdir("data/iris_in_meta"):
+        raise FileNotFoundError(
+            "Folder 'data/iris_in_meta' does not exist. Please create the 'iris_in_meta' dataset first"
+        )
+
+    # The Index is encoded the same way as 'Iris in Meta'
+    encoded = is_encoded(read_iris_in_meta())
+
+    output_dir = Path("data/iris_in_index")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if engine == "polars":
+        _process_index_polars(
+            index_path,
+            output_dir,
+            encoded=encoded,
+            workers=workers,
+            max_memory=parse_memory_size(max_memory) if max_memory else None,
+        )
+    elif engine == "dask":
+        _process_index_dask(index_path, output_dir, encoded=encoded)
+    else:
+        raise ValueError(f"Unknown engine '{engine}', expected 'polars' or 'dask'")
+
+    print(f"Iris In Index saved to '{output_dir}/iris_in_index.parquet'")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Process zip file containing OpenCitations Index CSV files"
@@ -74,6 +420,32 @@ if __name__ == "__main__":
         type=str,
         help="Path to the OpenCitations Index dump folder",
     )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=["polars", "dask"],
+        default="polars",
+        help="Engine used to filter the Index CSV files (default: polars)",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes filtering the Index archives (default: 1)",
+    )
+    parser.add_argument(
+        "--max_memory",
+        "--max-memory",
+        type=str,
+        help="Memory budget for the Index archives in flight, e.g. 16G",
+    )
 
     args = parser.parse_args()
-    process_index_dump(args.index_dump)
+    process_index_dump(
+        args.index_dump,
+        engine=args.engine,
+        workers=args.workers,
+        max_memory=args.max_memory,
+    )
@@ -1,120 +1,411 @@
 import os
-import tempfile
+import asyncio
+import json
+import shutil
+import zlib
+import multiprocessing
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from functools import lru_cache
 from zipfile import ZipFile
 import tarfile
-from requests import get
-from urllib.error import HTTPError
 
 from pathlib import Path
 from tqdm import tqdm
 
 import polars as pl
-from SPARQLWrapper import SPARQLWrapper, JSON
-from SPARQLWrapper.SPARQLExceptions import QueryBadFormed
 from dotenv import load_dotenv
 
-from iris import read_iris, get_iris_type_dict, get_iris_pids
+from iris import get_iris_context, get_iris_type_dict, get_iris_pids
+from iris_in_meta import encode_omids
+from profiling import profile_member
+from meta_sparql import META_SPARQL_ENDPOINT, MetaSparqlClient
+
+
+TITLES_SCHEMA = {
+    "title": pl.Utf8,
+    "omid": pl.Utf8,
+    "id": pl.Utf8,
+    "type": pl.Utf8,
+    "iris_id": pl.Int64,
+}
+
+
+TITLES_CHECKPOINT = "checkpoint.json"
+
+
+def get_noid_titles(iris_path) -> pl.DataFrame:
+    """
+    Return the ITEM_ID and TITLE of the IRIS entities with no ID, sorted by
+    ITEM_ID. Titles of less than 3 words are too generic to be searched.
+    """
+    # The titles are only joined to the entities with no ID, the other tables
+    # joined there can repeat an entity
+    return (
+        get_iris_context(iris_path)
+        .no_id.select("ITEM_ID", "TITLE")
+        .unique("ITEM_ID", keep="first", maintain_order=True)
+        .sort("ITEM_ID")
+        .drop_nulls("TITLE")
+        .with_columns(
+            pl.col("TITLE")
+            .str.replace_all("\r", " ", literal=True)
+            .str.replace_all("\n", "", literal=True)
+            .str.replace_all('"', "'", literal=True)
+        )
+        .filter(pl.col("TITLE").str.extract_all(r"\S+").list.len() >= 3)
+    )
 
 
-def get_type(doi, apikey):
-    HTTP_HEADERS = {"authorization": apikey}
-    API_CALL = "https://w3id.org/oc/meta/api/v1/metadata/{}"
+def _open_titles_checkpoint(parts_dir, resume=False):
+    """
+    Return the checkpoint of an interrupted title search when resuming, the
+    parts written after the checkpoint are removed.
+    """
+    checkpoint = {"last_item_id": None, "parts": []}
+    checkpoint_path = parts_dir / TITLES_CHECKPOINT
+
+    if resume and checkpoint_path.exists():
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        print(
+            f"Resuming, IRIS titles up to ITEM_ID {checkpoint['last_item_id']} "
+            "already processed"
+        )
 
-    response = get(API_CALL.format("doi:" + doi), headers=HTTP_HEADERS)
+    for part_path in parts_dir.glob("part-*"):
+        if part_path.name not in checkpoint["parts"]:
+            part_path.unlink()
 
-    try:
-        return response.json()[0]["type"]
-    except IndexError:
-        return None
+    return checkpoint
+
+
+def _save_titles_checkpoint(parts_dir, checkpoint, findings):
+    if findings:
+        part = f"part-{len(checkpoint['parts']):05d}.parquet"
+        pl.DataFrame(findings, schema=TITLES_SCHEMA).write_parquet(parts_dir / part)
+        checkpoint["parts"].append(part)
+
+    # The checkpoint is replaced at once, after the part it lists is written
+    tmp_path = parts_dir / f"{TITLES_CHECKPOINT}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, parts_dir / TITLES_CHECKPOINT)
 
 
-def search_for_titles(iris_path):
-    output_dir = "data/iris_in_meta"
-    os.makedirs(output_dir, exist_ok=True)
+async def _search_title_batches(client, batches, parts_dir, checkpoint, every):
+    findings = []
+    results = client.search(
+        [list(dict.fromkeys(title for _, title in batch)) for batch in batches]
+    )
+    with tqdm(total=sum(len(batch) for batch in batches)) as pbar:
+        batch_index = 0
+        async for batch_findings in results:
+            by_title = {}
+            for finding in batch_findings:
+                by_title.setdefault(finding["title"], []).append(finding)
+
+            for iris_id, title in batches[batch_index]:
+                for finding in by_title.get(title, []):
+                    findings.append({**finding, "iris_id": iris_id})
+
+            pbar.update(len(batches[batch_index]))
+            batch_index += 1
+
+            # The batches come in ITEM_ID order, so everything up to the last
+            # ITEM_ID of this batch is processed
+            if batch_index % every == 0 or batch_index == len(batches):
+                checkpoint["last_item_id"] = batches[batch_index - 1][-1][0]
+                _save_titles_checkpoint(parts_dir, checkpoint, findings)
+                findings = []
+
+
+def search_for_titles(
+    iris_path,
+    endpoint=META_SPARQL_ENDPOINT,
+    concurrency=4,
+    batch_size=50,
+    checkpoint_every=20,
+    resume=False,
+):
+    output_dir = Path("data/iris_in_meta")
+    parts_dir = output_dir / "titles_noid"
+    if parts_dir.exists() and not resume:
+        shutil.rmtree(parts_dir)
+    parts_dir.mkdir(parents=True, exist_ok=True)
     load_dotenv()
     OC_APIKEY = os.getenv("OC_APIKEY")
 
-    df = read_iris(iris_path, not_filtered=True)
+    checkpoint = _open_titles_checkpoint(parts_dir, resume)
 
-    iris_noid_titles = (
-        df.select("ITEM_ID", "IDE_DOI", "IDE_ISBN", "IDE_PMID", "TITLE")
-        .filter(
-            (
-                pl.col("IDE_DOI").is_null()
-                & pl.col("IDE_ISBN").is_null()
-                & pl.col("IDE_PMID").is_null()
-            ),
+    iris_noid_titles = get_noid_titles(iris_path)
+    if checkpoint["last_item_id"] is not None:
+        iris_noid_titles = iris_noid_titles.filter(
+            pl.col("ITEM_ID") > checkpoint["last_item_id"]
+        )
+
+    rows = iris_noid_titles.rows()
+    batches = [rows[i : i + batch_size] for i in range(0, len(rows), batch_size)]
+
+    client = MetaSparqlClient(endpoint, concurrency=concurrency, apikey=OC_APIKEY)
+    try:
+        asyncio.run(
+            _search_title_batches(
+                client, batches, parts_dir, checkpoint, checkpoint_every
+            )
         )
-        .drop("IDE_DOI", "IDE_ISBN", "IDE_PMID")
+    finally:
+        client.close()
+
+    titles_df = pl.concat(
+        [pl.DataFrame(schema=TITLES_SCHEMA)]
+        + [pl.read_parquet(parts_dir / part) for part in checkpoint["parts"]]
     )
+    titles_df.write_parquet(output_dir / "titles_noid.parquet")
 
-    sparql = SPARQLWrapper("https://opencitations.net/meta/sparql")
+    # The parts are only removed once the merged dataset is written
+    shutil.rmtree(parts_dir)
 
-    findings = []
+    print(f"Titles No ID saved to '{output_dir}/titles_noid.parquet'")
 
-    for iris_id, title in tqdm(
-        iris_noid_titles.iter_rows(), total=len(iris_noid_titles)
-    ):
-        title = title.replace("\r", " ").replace("\n", "").replace('"', "'")
-        if len(title.split()) < 3:
-            continue
-        try:
-            sparql.setQuery(f"""
-                            PREFIX datacite: <http://purl.org/spar/datacite/>
-                            PREFIX dcterms: <http://purl.org/dc/terms/>
-                            PREFIX literal: <http://www.essepuntato.it/2010/06/literalreification/>
-                            PREFIX fabio: <http://purl.org/spar/fabio/>
-                            SELECT ?entity ?doi ?type
-                            WHERE {{
-                                ?entity dcterms:title "{title}" ;
-                                    a ?type.
-                                ?entity datacite:hasIdentifier ?identifier.
-                                ?identifier datacite:usesIdentifierScheme datacite:doi.
-                                ?identifier literal:hasLiteralValue ?doi.
-                            FILTER (?type != fabio:Expression)
-                            }}""")
-            sparql.setReturnFormat(JSON)
-            results = sparql.query().convert()
-
-            if results["results"]["bindings"]:
-                for result in results["results"]["bindings"]:
-                    entity = result["entity"]["value"]
-                    doi = result["doi"]["value"]
-                    type = get_type(doi, OC_APIKEY)
-                    if type:
-                        findings.append(
-                            {
-                                "title": title,
-                                "omid": entity.replace(
-                                    "https://w3id.org/oc/meta/", "omid:"
-                                ),
-                                "id": "doi:" + doi,
-                                "type": type,
-                                "iris_id": iris_id,
-                            }
-                        )
-
-        except (QueryBadFormed, HTTPError):
-            continue
-
-    titles_df = pl.DataFrame(findings)
-
-    titles_df.write_parquet(os.path.join(output_dir, "titles_noid.parquet"))
-
-
-def process_meta(meta_path, iris_path):
-    if meta_path.endswith(".zip"):
-        process_meta_zip(meta_path, iris_path)
-    elif meta_path.endswith(".tar"):
-        process_meta_tar(meta_path, iris_path)
 
+META_MANIFEST = "manifest.jsonl"
 
-def process_meta_tar(tar_path, iris_path):
-    output_iim = Path("data/iris_in_meta")
-    output_iim.mkdir(parents=True, exist_ok=True)
+_iris_pids_lf = None
 
-    dois_isbns_pmids_lf = get_iris_pids(iris_path).lazy()
 
+def _init_meta_worker(iris_pids, polars_threads=None, initializer=None, initargs=()):
+    global _iris_pids_lf
+    if polars_threads is not None:
+        # Polars sizes its thread pool on first use, so this still applies
+        # after the module (and polars) has been imported by the worker
+        os.environ["POLARS_MAX_THREADS"] = str(polars_threads)
+    _iris_pids_lf = iris_pids.lazy() if iris_pids is not None else None
+    if initializer is not None:
+        initializer(*initargs)
+
+
+@lru_cache(maxsize=None)
+def _open_zip(zip_path):
+    return ZipFile(zip_path)
+
+
+def tokenize_meta_ids(lf, schemes=("doi", "pmid", "isbn")):
+    """
+    Split the space separated `id` column of Meta once and explode it into
+    one (omid, scheme, id) row per identifier of each entity, keeping only
+    the identifiers of the given schemes.
+    """
+    return (
+        lf.with_columns(pl.col("id").str.split(" "))
+        .with_columns(
+            pl.col("id")
+            .list.eval(pl.element().filter(pl.element().str.starts_with("omid:")))
+            .list.first()
+            .alias("omid")
+        )
+        .explode("id")
+        .with_columns(
+            pl.col("id").str.split_exact(":", 1).struct.field("field_0").alias("scheme")
+        )
+        .filter(pl.col("scheme").is_in(list(schemes)))
+    )
+
+
+def _filter_meta_csv(source, columns):
+    # Every identifier of an entity is matched, not only the first one found
+    return (
+        tokenize_meta_ids(
+            pl.scan_csv(source, schema_overrides={"pub_date": pl.String}).select(
+                columns
+            )
+        )
+        .drop("scheme")
+        .join(_iris_pids_lf, on="id", how="inner", maintain_order="left")
+        .collect()
+    )
+
+
+def _write_meta_member(df, members_dir, member_name):
+    if df.is_empty():
+        return None
+
+    # Write to a temporary file first, a member output is either complete
+    # or missing
+    output = os.path.basename(member_name).replace(".csv", ".parquet")
+    df.write_parquet(members_dir / f"{output}.tmp")
+    os.replace(members_dir / f"{output}.tmp", members_dir / output)
+
+    return output
+
+
+def _manifest_record(member_name, size, crc, output, rows):
+    return {
+        "member": member_name,
+        "size": size,
+        "crc": crc,
+        "output": output,
+        "rows": rows,
+    }
+
+
+def _open_meta_manifest(members_dir, iris_fingerprint, resume=False):
+    """
+    Open the manifest of the processed members for appending, returning it
+    along with the records already in it when resuming. The manifest starts
+    with the fingerprint of the IRIS dump the members were matched against,
+    and a run is only resumed with the same dump.
+    """
+    manifest_path = members_dir / META_MANIFEST
+    records = {}
+    content = b""
+
+    if resume and manifest_path.exists():
+        with open(manifest_path, "rb") as f:
+            content = f.read()
+        fingerprint = None
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a run killed while writing it
+                continue
+            if "iris_fingerprint" in record:
+                fingerprint = record["iris_fingerprint"]
+            else:
+                records[record["member"]] = record
+
+        if fingerprint != iris_fingerprint:
+            print(
+                "The IRIS dump changed since the interrupted run, processing every Meta CSV file again"
+            )
+            shutil.rmtree(members_dir)
+            members_dir.mkdir(parents=True)
+            records, content, resume = {}, b"", False
+        else:
+            print(f"Resuming, {len(records)} Meta CSV files already processed")
+    elif resume:
+        resume = False
+
+    manifest = open(manifest_path, "a" if resume else "w", encoding="utf-8")
+    if resume and content and not content.endswith(b"\n"):
+        manifest.write("\n")
+    if not resume:
+        _append_manifest_record(manifest, {"iris_fingerprint": iris_fingerprint})
+
+    return records, manifest
+
+
+def _append_manifest_record(manifest, record):
+    manifest.write(json.dumps(record) + "\n")
+    manifest.flush()
+    os.fsync(manifest.fileno())
+
+
+def _is_member_done(records, members_dir, member_name, size, crc):
+    record = records.get(member_name)
+    return (
+        record is not None
+        and record["size"] == size
+        and record["crc"] == crc
+        and (record["output"] is None or (members_dir / record["output"]).exists())
+    )
+
+
+def read_zip_member(zip_path, csv_file):
+    """
+    Read a decompressed member of a zip archive into memory, ready to be
+    handed to the Polars CSV parser without going through the filesystem.
+    """
+    with _open_zip(zip_path).open(csv_file, "r") as file:
+        return file.read()
+
+
+def _process_zip_member(zip_path, csv_file, members_dir):
+    info = _open_zip(zip_path).getinfo(csv_file)
+    with profile_member(
+        "iris_in_meta", csv_file, bytes_read=info.compress_size
+    ) as profile:
+        with profile.phase("decompress"):
+            data = read_zip_member(zip_path, csv_file)
+        with profile.phase("filter"):
+            df = _filter_meta_csv(data, ["id", "title", "type"])  # 'pub_date'
+        with profile.phase("write"):
+            output = _write_meta_member(df, members_dir, csv_file)
+        profile.set(rows_in=data.count(b"\n") - 1, rows_out=df.height)
+
+    return _manifest_record(csv_file, info.file_size, info.CRC, output, df.height)
+
+
+def _process_tar_member(member_name, data, members_dir):
+    with profile_member("iris_in_meta", member_name, bytes_read=len(data)) as profile:
+        with profile.phase("filter"):
+            df = _filter_meta_csv(data, ["id", "title", "type", "pub_date"])
+        with profile.phase("write"):
+            output = _write_meta_member(df, members_dir, member_name)
+        profile.set(rows_in=data.count(b"\n") - 1, rows_out=df.height)
+
+    return _manifest_record(member_name, len(data), zlib.crc32(data), output, df.height)
+
+
+def _run_meta_members(
+    tasks,
+    iris_pids,
+    workers=1,
+    desc=None,
+    total=None,
+    callback=None,
+    initializer=None,
+    initargs=(),
+):
+    """
+    Run every `(function, *args)` task, spreading them over a pool of
+    `workers` processes when more than one is requested. The result of each
+    task is passed to `callback` in the calling process. `initializer` is
+    called with `initargs` once in each process before its tasks.
+    """
+
+    def done(result):
+        if callback is not None:
+            callback(result)
+
+    if workers <= 1:
+        _init_meta_worker(iris_pids, initializer=initializer, initargs=initargs)
+        for func, *args in tqdm(tasks, desc=desc, total=total):
+            done(func(*args))
+        return
+
+    polars_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_meta_worker,
+        initargs=(iris_pids, polars_threads, initializer, initargs),
+    ) as executor, tqdm(desc=desc, total=total) as pbar:
+        pending = set()
+        for func, *args in tasks:
+            # Keep a bounded number of members in flight, tar members are
+            # shipped to the workers as raw bytes
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done(future.result())
+                    pbar.update(1)
+            pending.add(executor.submit(func, *args))
+
+        for future in as_completed(pending):
+            done(future.result())
+            pbar.update(1)
+
+
+def _merge_meta_members(output_iim, members_dir, iris_path, encoded=False):
     preference = pl.LazyFrame(
         {
             "type": ["journal article", "book chapter", "book chapter"],
@@ -123,144 +414,344 @@ def process_meta_tar(tar_path, iris_path):
         }
     )
 
-    pbar = tqdm(desc="Processing OCMETA CSV files")
+    iim = pl.scan_parquet(members_dir / "*.parquet")
+    if encoded:
+        iim = iim.with_columns(encode_omids(pl.col("omid")))
+
+    # Stable sort and ordered grouping make the result independent of how
+    # the members were processed
+    with profile_member("iris_in_meta", "merge"):
+        (
+            iim.join(preference, on=["type", "iris_type"], how="left")
+            .sort("preference", descending=True, nulls_last=True, maintain_order=True)
+            .group_by("id", maintain_order=True)
+            .first()
+            .drop("preference")
+            .with_columns(
+                pl.col("iris_type").replace_strict(get_iris_type_dict(iris_path))
+            )
+            .rename({"type": "meta_type"})
+        ).sink_parquet(output_iim / "iris_in_meta.parquet")
+
+    # The member outputs are only removed once the merged dataset is written
+    shutil.rmtree(members_dir)
+
+    print(f"Iris In Meta saved to '{output_iim}/iris_in_meta.parquet'")
 
-    with tarfile.open(tar_path, "r:*") as tar:
+
+def process_meta(meta_path, iris_path, workers=1, resume=False, encoded=False):
+    if os.path.isdir(meta_path):
+        process_meta_store(meta_path, iris_path, encoded=encoded)
+    elif meta_path.endswith(".zip"):
+        process_meta_zip(
+            meta_path, iris_path, workers=workers, resume=resume, encoded=encoded
+        )
+    elif meta_path.endswith(".tar"):
+        process_meta_tar(
+            meta_path, iris_path, workers=workers, resume=resume, encoded=encoded
+        )
+
+
+def _meta_members_dir(output_iim, resume=False):
+    members_dir = output_iim / "members"
+    if members_dir.exists() and not resume:
+        shutil.rmtree(members_dir)
+    members_dir.mkdir(parents=True, exist_ok=True)
+
+    return members_dir
+
+
+def process_meta_tar(tar_path, iris_path, workers=1, resume=False, encoded=False):
+    output_iim = Path("data/iris_in_meta")
+    members_dir = _meta_members_dir(output_iim, resume=resume)
+
+    dois_isbns_pmids = get_iris_pids(iris_path)
+
+    records, manifest = _open_meta_manifest(
+        members_dir, get_iris_context(iris_path).fingerprint, resume=resume
+    )
+
+    def tasks(tar):
         while True:
             csv_member = tar.next()
             if csv_member is None:
                 break
             if csv_member.isfile() and csv_member.name.endswith(".csv"):
-                pbar.update(1)
-                member_df = (
-                    pl.scan_csv(
-                        tar.extractfile(csv_member),
-                        schema_overrides={"pub_date": pl.String},
-                    )
-                    .select(["id", "title", "type", "pub_date"])
-                    .with_columns(
-                        (pl.col("id").str.extract(r"(omid:[^\s]+)")).alias("omid"),
-                        (pl.col("id").str.extract(r"((?:doi):[^\s\"]+)")).alias("doi"),
-                        (pl.col("id").str.extract(r"((?:pmid):[^\s\"]+)")).alias(
-                            "pmid"
-                        ),
-                        (pl.col("id").str.extract(r"((?:isbn):[^\s\"]+)")).alias(
-                            "isbn"
-                        ),
-                    )
-                    .with_columns(
-                        pl.coalesce(
-                            [pl.col("doi"), pl.col("pmid"), pl.col("isbn")]
-                        ).alias("id")
-                    )
-                    .drop(["doi", "pmid", "isbn"])
-                    .drop_nulls("id")
-                    .join(dois_isbns_pmids_lf, on="id", how="inner")
-                    .collect()
-                )
-
-                if not member_df.is_empty():
-                    member_df.write_parquet(
-                        os.path.join(
-                            output_iim,
-                            os.path.basename(csv_member.name).replace(
-                                ".csv", ".parquet"
-                            ),
-                        )
+                data = tar.extractfile(csv_member).read()
+                if _is_member_done(
+                    records,
+                    members_dir,
+                    csv_member.name,
+                    len(data),
+                    zlib.crc32(data),
+                ):
+                    continue
+                yield (_process_tar_member, csv_member.name, data, members_dir)
+
+    with manifest, tarfile.open(tar_path, "r:*") as tar:
+        _run_meta_members(
+            tasks(tar),
+            dois_isbns_pmids,
+            workers=workers,
+            desc="Processing OCMETA CSV files",
+            callback=lambda record: _append_manifest_record(manifest, record),
+        )
+
+    _merge_meta_members(output_iim, members_dir, iris_path, encoded=encoded)
+
+
+def process_meta_zip(zip_path, iris_path, workers=1, resume=False, encoded=False):
+    output_iim = Path("data/iris_in_meta")
+    members_dir = _meta_members_dir(output_iim, resume=resume)
+
+    records, manifest = _open_meta_manifest(
+        members_dir, get_iris_context(iris_path).fingerprint, resume=resume
+    )
+
+    with ZipFile(zip_path) as zip_file:
+        files_list = [
+            info.filename
+            for info in zip_file.infolist()
+            if info.filename.endswith(".csv")
+            and not _is_member_done(
+                records, members_dir, info.filename, info.file_size, info.CRC
+            )
+        ]
+
+    dois_isbns_pmids = get_iris_pids(iris_path)
+
+    with manifest:
+        _run_meta_members(
+            (
+                (_process_zip_member, zip_path, csv_file, members_dir)
+                for csv_file in files_list
+            ),
+            dois_isbns_pmids,
+            workers=workers,
+            desc="Processing Meta CSV files",
+            total=len(files_list),
+            callback=lambda record: _append_manifest_record(manifest, record),
+        )
+
+    _merge_meta_members(output_iim, members_dir, iris_path, encoded=encoded)
+
+
+META_STORE_COLUMNS = ["id", "title", "type", "pub_date", "venue", "author"]
+META_STORE_SCHEMES = ["omid", "doi", "pmid", "isbn"]
+
+
+def _meta_bucket(buckets):
+    # Polars only guarantees stable hashes within the same version, which is
+    # why the version is recorded in the store metadata
+    return (pl.col("id").hash(seed=0) % buckets).cast(pl.Int64).alias("bucket")
+
+
+def _store_meta_chunk(sources, chunk_id, store_path, buckets):
+    with profile_member(
+        "meta_store", f"chunk-{chunk_id}", bytes_read=sum(len(s) for s in sources)
+    ) as profile:
+        _write_meta_chunk(sources, chunk_id, store_path, buckets, profile)
+
+
+def _write_meta_chunk(sources, chunk_id, store_path, buckets, profile):
+    with profile.phase("parse"):
+        df = (
+            pl.concat(
+                [
+                    tokenize_meta_ids(
+                        pl.scan_csv(
+                            source,
+                            schema_overrides={c: pl.String for c in META_STORE_COLUMNS},
+                        ).select(META_STORE_COLUMNS),
+                        schemes=META_STORE_SCHEMES,
                     )
+                    for source in sources
+                ]
+            )
+            .with_columns(_meta_bucket(buckets))
+            .collect()
+        )
 
-    (
-        pl.scan_parquet(output_iim / "*.parquet")
-        .join(preference, on=["type", "iris_type"], how="left")
-        .sort("preference", descending=True, nulls_last=True)
-        .group_by("id")
-        .first()
-        .drop("preference")
-        .with_columns(pl.col("iris_type").replace_strict(get_iris_type_dict(iris_path)))
-        .rename({"type": "meta_type"})
-    ).sink_parquet(output_iim / "iris_in_meta.parquet")
-
-    for file in os.listdir(output_iim):
-        if file != "iris_in_meta.parquet":
-            os.remove(os.path.join(output_iim, file))
+    with profile.phase("write"):
+        for (scheme, bucket), part_df in df.partition_by(
+            ["scheme", "bucket"], as_dict=True, include_key=False
+        ).items():
+            part_dir = store_path / f"scheme={scheme}" / f"bucket={bucket}"
+            part_dir.mkdir(parents=True, exist_ok=True)
+            part_df.write_parquet(part_dir / f"part-{chunk_id:05d}.parquet")
 
-    print(f"Iris In Meta saved to '{output_iim}/iris_in_meta.parquet'")
+    profile.set(rows_in=sum(s.count(b"\n") - 1 for s in sources), rows_out=df.height)
 
 
-def process_meta_zip(zip_path, iris_path):
-    zip_file = ZipFile(zip_path)
-    files_list = [
-        zipfile for zipfile in zip_file.namelist() if zipfile.endswith(".csv")
-    ]
+def _process_zip_chunk(func, zip_path, csv_files, chunk_id, *args):
+    return func(
+        [read_zip_member(zip_path, csv_file) for csv_file in csv_files],
+        chunk_id,
+        *args,
+    )
 
-    output_iim = Path("data/iris_in_meta")
-    output_iim.mkdir(parents=True, exist_ok=True)
 
-    dois_isbns_pmids_lf = get_iris_pids(iris_path).lazy()
+def convert_meta_chunks(
+    meta_path,
+    func,
+    args=(),
+    chunk_size=100,
+    workers=1,
+    callback=None,
+    initializer=None,
+    initargs=(),
+):
+    """
+    Call `func(sources, chunk_id, *args)` on the chunks of `chunk_size` CSV
+    files of a Meta zip or tar dump, `sources` being the contents of the CSV
+    files of the chunk. `func` runs in `workers` processes and its results
+    are passed to `callback`. The `args` are sent with every chunk, whereas
+    `initializer(*initargs)` runs once in each process, so that large data
+    can be sent to the workers once.
+    """
+    if meta_path.endswith(".zip"):
+        with ZipFile(meta_path) as zip_file:
+            files_list = [n for n in zip_file.namelist() if n.endswith(".csv")]
+        chunks = [
+            files_list[i : i + chunk_size]
+            for i in range(0, len(files_list), chunk_size)
+        ]
+        _run_meta_members(
+            (
+                (_process_zip_chunk, func, meta_path, csv_files, chunk_id, *args)
+                for chunk_id, csv_files in enumerate(chunks)
+            ),
+            None,
+            workers=workers,
+            desc="Converting Meta CSV files",
+            total=len(chunks),
+            callback=callback,
+            initializer=initializer,
+            initargs=initargs,
+        )
+    elif meta_path.endswith(".tar"):
 
-    preference = pl.LazyFrame(
-        {
-            "type": ["journal article", "book chapter", "book chapter"],
-            "iris_type": [35, 41, 42],
-            "preference": [0, 1, 2],
-        }
+        def tasks(tar):
+            chunk = []
+            chunk_id = 0
+            for csv_member in tar:
+                if csv_member.isfile() and csv_member.name.endswith(".csv"):
+                    chunk.append(tar.extractfile(csv_member).read())
+                if len(chunk) == chunk_size:
+                    yield (func, chunk, chunk_id, *args)
+                    chunk = []
+                    chunk_id += 1
+            if chunk:
+                yield (func, chunk, chunk_id, *args)
+
+        with tarfile.open(meta_path, "r:*") as tar:
+            _run_meta_members(
+                tasks(tar),
+                None,
+                workers=workers,
+                desc="Converting Meta CSV files",
+                callback=callback,
+                initializer=initializer,
+                initargs=initargs,
+            )
+    else:
+        raise ValueError(f"Unsupported Meta dump '{meta_path}', expected a zip or tar")
+
+
+def build_meta_store(
+    meta_path, store_path="data/meta_store", buckets=16, chunk_size=100, workers=1
+):
+    """
+    Convert a Meta zip or tar dump into a Parquet dataset with one row per
+    identifier, hive-partitioned by identifier scheme and hash bucket of the
+    identifier. The `omid` partition holds exactly one row per entity.
+    """
+    store_path = Path(store_path)
+    if store_path.exists() and any(store_path.iterdir()):
+        raise FileExistsError(
+            f"Folder '{store_path}' already exists and is not empty. Please remove it or choose another path."
+        )
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    convert_meta_chunks(
+        meta_path,
+        _store_meta_chunk,
+        (store_path, buckets),
+        chunk_size=chunk_size,
+        workers=workers,
     )
 
-    for csv_file in tqdm(files_list, desc="Processing Meta CSV files"):
-        with zip_file.open(csv_file, "r") as file:
-            # Source: https://vdavez.com/2024/01/how-to-use-scan_csv-with-a-file-like-object-in-polars/
-            with tempfile.NamedTemporaryFile() as tf:
-                tf.write(file.read())
-                tf.seek(0)
-                os.makedirs(output_iim, exist_ok=True)
-                df = (
-                    pl.scan_csv(tf.name)
-                    .select(["id", "title", "type"])  # 'pub_date'
-                    .with_columns(
-                        (pl.col("id").str.extract(r"(omid:[^\s]+)")).alias("omid"),
-                        (pl.col("id").str.extract(r"((?:doi):[^\s\"]+)")).alias("doi"),
-                        (pl.col("id").str.extract(r"((?:pmid):[^\s\"]+)")).alias(
-                            "pmid"
-                        ),
-                        (pl.col("id").str.extract(r"((?:isbn):[^\s\"]+)")).alias(
-                            "isbn"
-                        ),
-                    )
-                    .with_columns(
-                        pl.coalesce(
-                            [pl.col("doi"), pl.col("pmid"), pl.col("isbn")]
-                        ).alias("id")
-                    )
-                    .drop(["doi", "pmid", "isbn"])
-                    .drop_nulls("id")
-                    .join(dois_isbns_pmids_lf, on="id", how="inner")
-                    .collect()
-                )
+    with open(store_path / "meta_store.json", "w") as f:
+        json.dump(
+            {
+                "buckets": buckets,
+                "columns": META_STORE_COLUMNS,
+                "polars_version": pl.__version__,
+            },
+            f,
+            indent=2,
+        )
+
+    print(f"Meta store saved to '{store_path}'")
+
+
+def scan_meta_store(store_path="data/meta_store"):
+    store_path = Path(store_path)
+    if not (store_path / "meta_store.json").exists():
+        raise FileNotFoundError(
+            f"Folder '{store_path}' is not a Meta store. Please create it with the 'create_meta_store.py' script first."
+        )
+
+    return pl.scan_parquet(
+        store_path / "scheme=*" / "bucket=*" / "*.parquet",
+        hive_partitioning=True,
+        hive_schema={"scheme": pl.String, "bucket": pl.Int64},
+    )
+
+
+def process_meta_store(store_path, iris_path, encoded=False):
+    store_path = Path(store_path)
+    store_lf = scan_meta_store(store_path)
+    with open(store_path / "meta_store.json") as f:
+        metadata = json.load(f)
+
+    output_iim = Path("data/iris_in_meta")
+    members_dir = _meta_members_dir(output_iim)
+
+    dois_isbns_pmids = get_iris_pids(iris_path)
+
+    if metadata["polars_version"] == pl.__version__:
+        # Match one bucket at a time, only the partitions of that bucket are read
+        buckets = range(metadata["buckets"])
+        dois_isbns_pmids = dois_isbns_pmids.with_columns(
+            _meta_bucket(metadata["buckets"])
+        )
+    else:
+        print(
+            f"Meta store built with Polars {metadata['polars_version']}, "
+            "bucket pruning disabled."
+        )
+        buckets = [None]
+
+    for bucket in tqdm(buckets, desc="Processing Meta store buckets"):
+        meta_lf = store_lf.filter(pl.col("scheme").is_in(["doi", "pmid", "isbn"]))
+        pids_df = dois_isbns_pmids
+        if bucket is not None:
+            meta_lf = meta_lf.filter(pl.col("bucket") == bucket)
+            pids_df = pids_df.filter(pl.col("bucket") == bucket).drop("bucket")
+
+        with profile_member("iris_in_meta", f"bucket-{bucket or 0}") as profile:
+            df = (
+                meta_lf.select(["id", "title", "type", "pub_date", "omid"])
+                .join(pids_df.lazy(), on="id", how="inner", maintain_order="left")
+                .collect()
+            )
+            profile.set(rows_out=df.height)
 
             if not df.is_empty():
-                df.write_parquet(
-                    os.path.join(
-                        output_iim,
-                        os.path.basename(csv_file).replace(".csv", ".parquet"),
-                    )
-                )
-
-    (
-        pl.scan_parquet(output_iim / "*.parquet")
-        .join(preference, on=["type", "iris_type"], how="left")
-        .sort("preference", descending=True, nulls_last=True)
-        .group_by("id")
-        .first()
-        .drop("preference")
-        .with_columns(pl.col("iris_type").replace_strict(get_iris_type_dict(iris_path)))
-        .rename({"type": "meta_type"})
-    ).sink_parquet(output_iim / "iris_in_meta.parquet")
-
-    for file in os.listdir(output_iim):
-        if file != "iris_in_meta.parquet":
-            os.remove(os.path.join(output_iim, file))
+                df.write_parquet(members_dir / f"bucket-{bucket or 0:05d}.parquet")
 
-    print(f"Iris In Meta saved to '{output_iim}/iris_in_meta.parquet'")
+    _merge_meta_members(output_iim, members_dir, iris_path, encoded=encoded)
 
 
 def create_iris_not_in_meta(iris_path):
@@ -276,7 +767,7 @@ def create_iris_not_in_meta(iris_path):
 
     dois_isbns_pmids_lf = get_iris_pids(iris_path).lazy()
 
-    lf_iim = pl.scan_parquet(iim_path / "*.parquet")
+    lf_iim = pl.scan_parquet(iim_path / "iris_in_meta.parquet")
 
     inim = dois_isbns_pmids_lf.lazy().join(lf_iim, on="iris_id", how="anti").collect()
 
@@ -289,7 +780,7 @@ def create_iris_noid(iris_path):
     output_inoid = Path("data/iris_no_id")
     output_inoid.mkdir(parents=True, exist_ok=True)
 
-    iris_noid = read_iris(iris_path, no_id=True)
+    iris_noid = get_iris_context(iris_path).no_id
 
     iris_noid.write_parquet(output_inoid / "iris_no_id.parquet")
 
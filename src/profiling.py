@@ -0,0 +1,220 @@
+import cProfile
+import json
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Set in the environment so that the spawned worker processes inherit them
+PROFILE_DIR_ENV = "ATREIDES_PROFILE_DIR"
+PROFILE_TOP_ENV = "ATREIDES_PROFILE_TOP"
+
+_stages = []
+_slowest = []
+
+
+def enable(top=0):
+    """
+    Enable the profiling of the pipeline stages and members. With `top`
+    greater than 0, every member is also run under cProfile and the pstats
+    dumps of the `top` slowest ones are kept.
+    """
+    os.environ[PROFILE_DIR_ENV] = tempfile.mkdtemp(prefix="atreides-profile-")
+    os.environ[PROFILE_TOP_ENV] = str(top)
+
+
+def is_enabled():
+    return PROFILE_DIR_ENV in os.environ
+
+
+def _peak_rss(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(who).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def _cpu_time(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+class MemberRecord(dict):
+    def phase(self, name):
+        return _timed(self.setdefault("phases", {}), name)
+
+    def set(self, **values):
+        self.update(values)
+
+
+class _NullMember:
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def set(self, **values):
+        pass
+
+
+@contextmanager
+def _timed(phases, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+
+@contextmanager
+def profile_member(stage, member, bytes_read=None):
+    """
+    Profile the processing of one input member (a CSV file, an archive...)
+    of a stage. The yielded record takes the rows in and out with `set` and
+    times sub-steps with `phase`. The record is appended to a file of the
+    current process, so that it also works in the worker processes.
+    """
+    if not is_enabled():
+        yield _NullMember()
+        return
+
+    record = MemberRecord(stage=stage, member=member, bytes_read=bytes_read)
+    top = int(os.environ[PROFILE_TOP_ENV])
+    profiler = cProfile.Profile() if top > 0 else None
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record["wall_time_s"] = time.perf_counter() - start
+        record["cpu_time_s"] = time.process_time() - cpu_start
+        record["peak_rss_mb"] = _peak_rss() / 1024**2
+
+        profile_dir = Path(os.environ[PROFILE_DIR_ENV])
+        if profiler is not None:
+            record["pstats"] = _keep_if_slowest(profiler, record, profile_dir, top)
+
+        with open(profile_dir / f"members-{os.getpid()}.jsonl", "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def _keep_if_slowest(profiler, record, profile_dir, top):
+    # Only the `top` slowest dumps of each process are kept on disk, the
+    # report then keeps the `top` slowest overall
+    wall_time = record["wall_time_s"]
+    if len(_slowest) >= top and wall_time <= _slowest[-1][0]:
+        return None
+
+    name = re.sub(r"[^\w.-]", "_", f"{record['stage']}-{record['member']}")
+    path = profile_dir / f"{name}-{os.getpid()}-{time.monotonic_ns()}.pstats"
+    profiler.dump_stats(path)
+
+    _slowest.append((wall_time, path))
+    _slowest.sort(reverse=True)
+    if len(_slowest) > top:
+        _, dropped = _slowest.pop()
+        dropped.unlink(missing_ok=True)
+
+    return str(path)
+
+
+@contextmanager
+def profile_stage(stage):
+    """
+    Profile a whole stage of the pipeline, including the worker processes it
+    starts and joins.
+    """
+    if not is_enabled():
+        yield
+        return
+
+    start = time.perf_counter()
+    cpu_start = _cpu_time(resource.RUSAGE_SELF) + _cpu_time(resource.RUSAGE_CHILDREN)
+    try:
+        yield
+    finally:
+        _stages.append(
+            {
+                "stage": stage,
+                "wall_time_s": time.perf_counter() - start,
+                "cpu_time_s": _cpu_time(resource.RUSAGE_SELF)
+                + _cpu_time(resource.RUSAGE_CHILDREN)
+                - cpu_start,
+                "peak_rss_mb": max(
+                    _peak_rss(resource.RUSAGE_SELF),
+                    _peak_rss(resource.RUSAGE_CHILDREN),
+                )
+                / 1024**2,
+            }
+        )
+
+
+def write_report(report_path):
+    """
+    Write the profiling report of the stages and members run so far to
+    `report_path`, moving the kept pstats dumps next to it.
+    """
+    report_path = Path(report_path)
+    profile_dir = Path(os.environ[PROFILE_DIR_ENV])
+    top = int(os.environ[PROFILE_TOP_ENV])
+
+    members = []
+    for members_file in sorted(profile_dir.glob("members-*.jsonl")):
+        with open(members_file) as f:
+            members.extend(json.loads(line) for line in f)
+
+    stages = []
+    for stage in _stages:
+        stage_members = [m for m in members if m["stage"] == stage["stage"]]
+        stages.append(
+            {
+                **stage,
+                "bytes_read": sum(m["bytes_read"] or 0 for m in stage_members),
+                "rows_in": sum(m.get("rows_in") or 0 for m in stage_members),
+                "rows_out": sum(m.get("rows_out") or 0 for m in stage_members),
+                "members": stage_members,
+            }
+        )
+
+    for member in members:
+        if member.get("pstats") and not Path(member["pstats"]).exists():
+            member["pstats"] = None
+
+    slowest = sorted(
+        (m for m in members if m.get("pstats")),
+        key=lambda m: m["wall_time_s"],
+        reverse=True,
+    )
+    if slowest:
+        pstats_dir = report_path.with_name(report_path.stem + "_pstats")
+        pstats_dir.mkdir(parents=True, exist_ok=True)
+        for member in slowest[:top]:
+            member["pstats"] = str(
+                shutil.move(member["pstats"], pstats_dir / Path(member["pstats"]).name)
+            )
+        for member in slowest[top:]:
+            member["pstats"] = None
+
+    with open(report_path, "w") as f:
+        json.dump(
+            {
+                "stages": stages,
+                "slowest_members": [
+                    {k: m[k] for k in ("stage", "member", "wall_time_s", "pstats")}
+                    for m in slowest[:top]
+                ],
+            },
+            f,
+            indent=2,
+        )
+
+    shutil.rmtree(profile_dir)
+    print(f"Profiling report saved to '{report_path}'")
@@ -0,0 +1,207 @@
+from pathlib import Path
+
+import polars as pl
+
+from iris import get_iris_context
+from meta_titles import normalize_titles
+from oc_meta import TITLES_SCHEMA, convert_meta_chunks, tokenize_meta_ids
+
+LINKAGE_COLUMNS = ["id", "title", "author", "pub_date", "type", "publisher"]
+# Weights of the fields in the score of a candidate, the publication year and
+# the first author are already equal within a block
+LINKAGE_WEIGHTS = {"title": 0.7, "authors": 0.15, "publisher": 0.15}
+
+
+def normalize_names(expr):
+    """
+    Lowercase the names and strip their accents and any character that is
+    not a letter.
+    """
+    return (
+        expr.str.normalize("NFKD")
+        .str.replace_all(r"\p{Mn}", "")
+        .str.to_lowercase()
+        .str.replace_all(r"[^\p{L}]", "")
+    )
+
+
+def _without_meta_ids(expr):
+    # Meta follows every agent with its identifiers in brackets
+    return expr.str.replace_all(r"\s*\[[^\]]*\]", "")
+
+
+def _first_surname(expr):
+    # Both IRIS and Meta list the people as 'Surname, Name; Surname, Name'
+    return normalize_names(
+        expr.str.split(";").list.first().str.split(",").list.first()
+    ).alias("surname")
+
+
+def _title_words(expr):
+    return normalize_titles(expr).str.split(" ").list.unique()
+
+
+def get_linkage_records(iris_path) -> pl.DataFrame:
+    """
+    Return the blocking keys (publication year and normalized surname of the
+    first author) and the compared fields of the IRIS entities with no ID.
+    Entities without a year or an author can't be blocked and are left out.
+    """
+    return (
+        get_iris_context(iris_path)
+        .no_id.unique("ITEM_ID", keep="first", maintain_order=True)
+        .select(
+            "ITEM_ID",
+            "TITLE",
+            pl.col("DATE_ISSUED_YEAR").cast(pl.Int64, strict=False).alias("year"),
+            _first_surname(pl.col("DES_ALLPEOPLE").cast(pl.Utf8)),
+            pl.col("DES_NUMBEROFAUTHORS").cast(pl.Int64, strict=False).alias("authors"),
+            normalize_names(pl.col("PUB_NAME").cast(pl.Utf8)).alias("publisher"),
+            _title_words(pl.col("TITLE")).alias("words"),
+        )
+        .drop_nulls(["TITLE", "year", "surname"])
+        .filter(pl.col("surname") != "")
+    )
+
+
+_records_lf = None
+
+
+def _init_link_worker(records):
+    global _records_lf
+    _records_lf = records.lazy()
+
+
+def _link_meta_chunk(sources, chunk_id, top_k, threshold):
+    meta_words = _title_words(pl.col("title"))
+    title_similarity = (
+        pl.col("words").list.set_intersection(meta_words).list.len()
+        / pl.col("words").list.set_union(meta_words).list.len()
+    )
+    same_authors = (
+        pl.col("author").str.split(";").list.len() == pl.col("authors")
+    ).fill_null(False)
+    same_publisher = (
+        normalize_names(_without_meta_ids(pl.col("publisher")))
+        == pl.col("publisher_right")
+    ).fill_null(False)
+
+    candidates = (
+        pl.concat(
+            [
+                pl.scan_csv(
+                    source, schema_overrides={c: pl.String for c in LINKAGE_COLUMNS}
+                ).select(LINKAGE_COLUMNS)
+                for source in sources
+            ]
+        )
+        # Only the entities with a DOI can be candidates
+        .filter(pl.col("id").str.contains("doi:", literal=True))
+        .with_columns(
+            pl.col("pub_date")
+            .str.slice(0, 4)
+            .cast(pl.Int64, strict=False)
+            .alias("year"),
+            _first_surname(_without_meta_ids(pl.col("author"))),
+        )
+        .join(_records_lf, on=["year", "surname"], how="inner")
+        .with_columns(title_similarity.fill_null(0).alias("title_similarity"))
+        .with_columns(
+            (
+                LINKAGE_WEIGHTS["title"] * pl.col("title_similarity")
+                + LINKAGE_WEIGHTS["authors"] * same_authors
+                + LINKAGE_WEIGHTS["publisher"] * same_publisher
+            ).alias("score")
+        )
+        .filter(pl.col("score") >= threshold)
+        .sort(["ITEM_ID", "score"], descending=[False, True], maintain_order=True)
+        .group_by("ITEM_ID", maintain_order=True)
+        .head(top_k)
+    )
+
+    return (
+        tokenize_meta_ids(candidates, schemes=("doi",))
+        .select(
+            "ITEM_ID",
+            "TITLE",
+            "omid",
+            "id",
+            "type",
+            pl.col("title").alias("meta_title"),
+            "title_similarity",
+            "score",
+        )
+        .collect()
+    )
+
+
+def link_noid_records(
+    iris_path, meta_path, top_k=5, threshold=0.5, chunk_size=100, workers=1
+):
+    """
+    Link the IRIS entities with no ID to the Meta entities with a DOI of the
+    same publication year and first author, keeping the `top_k` candidates of
+    each entity with a score of at least `threshold`. The score weights the
+    similarity of the title words, and whether the numbers of authors and the
+    publishers agree, by LINKAGE_WEIGHTS.
+    """
+    output_dir = Path("data/iris_in_meta")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    records = get_linkage_records(iris_path)
+
+    results = [pl.DataFrame()]
+    convert_meta_chunks(
+        meta_path,
+        _link_meta_chunk,
+        (top_k, threshold),
+        chunk_size=chunk_size,
+        workers=workers,
+        callback=results.append,
+        # The records are sent once to each worker rather than with every
+        # chunk
+        initializer=_init_link_worker,
+        initargs=(records,),
+    )
+    candidates = pl.concat(results, how="diagonal")
+
+    if candidates.is_empty():
+        titles_df = pl.DataFrame(
+            schema={
+                **TITLES_SCHEMA,
+                "meta_title": pl.Utf8,
+                "title_similarity": pl.Float64,
+                "score": pl.Float64,
+            }
+        )
+    else:
+        # The candidates of an entity can come from different chunks
+        best = (
+            candidates.select("ITEM_ID", "omid", "score")
+            .unique(["ITEM_ID", "omid"])
+            .sort(["ITEM_ID", "score", "omid"], descending=[False, True, False])
+            .group_by("ITEM_ID", maintain_order=True)
+            .head(top_k)
+        )
+        titles_df = (
+            candidates.join(best, on=["ITEM_ID", "omid", "score"], how="semi")
+            .select(
+                pl.col("TITLE").alias("title"),
+                "omid",
+                "id",
+                "type",
+                pl.col("ITEM_ID").alias("iris_id"),
+                "meta_title",
+                "title_similarity",
+                "score",
+            )
+            .cast(TITLES_SCHEMA)
+            .sort(
+                ["iris_id", "score", "omid", "id"],
+                descending=[False, True, False, False],
+            )
+        )
+
+    titles_df.write_parquet(output_dir / "titles_noid.parquet")
+
+    print(f"Titles No ID saved to '{output_dir}/titles_noid.parquet'")
@@ -0,0 +1,94 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from pathlib import Path
+
+# In the repository, whatever the current directory, e.g. a notebook folder
+RESULT_CACHE_DIR = Path(__file__).resolve().parents[1] / "data" / ".cache" / "answers"
+
+enabled = True
+
+
+def _parquet_footer_hash(path):
+    # The footer holds the schema and the row group statistics, it changes
+    # whenever the content of the file does
+    with open(path, "rb") as f:
+        f.seek(-8, os.SEEK_END)
+        footer_length = int.from_bytes(f.read(4), "little")
+        f.seek(-8 - footer_length, os.SEEK_END)
+        return hashlib.sha256(f.read(footer_length)).hexdigest()
+
+
+def fingerprint(paths):
+    """
+    Fingerprint the Parquet files at the given paths (files, or folders of
+    Parquet files) by path, size, modification time and footer hash.
+    """
+    files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files.extend(sorted(path.glob("*.parquet")))
+        elif path.exists():
+            files.append(path)
+
+    entries = []
+    for file in files:
+        stat = file.stat()
+        entries.append(
+            [
+                str(file.resolve()),
+                stat.st_size,
+                stat.st_mtime_ns,
+                _parquet_footer_hash(file),
+            ]
+        )
+
+    return hashlib.sha256(json.dumps(entries).encode()).hexdigest()
+
+
+def cached_answer(func):
+    """
+    Cache the result of a function whose arguments are the paths of the
+    datasets it reads. The cached result is reused as long as the
+    fingerprint of those datasets does not change. Results that are not
+    computed (the error messages returned as strings) are never cached.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        paths = [str(Path(v).resolve()) for v in bound.arguments.values()]
+
+        key = hashlib.sha256(json.dumps(paths).encode()).hexdigest()[:16]
+        cache_file = RESULT_CACHE_DIR / f"{func.__name__}-{key}.pkl"
+        current = fingerprint(paths)
+
+        if cache_file.exists():
+            try:
+                with open(cache_file, "rb") as f:
+                    cached_fingerprint, result = pickle.load(f)
+                if cached_fingerprint == current:
+                    return result
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+
+        result = func(*args, **kwargs)
+        if not isinstance(result, str):
+            RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(".tmp")
+            with open(tmp_file, "wb") as f:
+                pickle.dump((current, result), f)
+            os.replace(tmp_file, cache_file)
+
+        return result
+
+    return wrapper
@@ -0,0 +1,321 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from meta_titles import TITLE_INDEX_COLUMNS, normalize_titles
+from oc_meta import (
+    TITLES_SCHEMA,
+    convert_meta_chunks,
+    get_noid_titles,
+    tokenize_meta_ids,
+)
+
+# Number of titles whose shingles are hashed at the same time, which bounds
+# the memory used to compute the signatures
+SIGNATURE_BLOCK_SIZE = 50_000
+FNV_PRIME = np.uint64(0x100000001B3)
+
+
+def _permutations(num_perm, seed):
+    # Multiply-add-shift hashing, `a` has to be odd
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(titles, num_perm=32, shingle_size=5, seed=0):
+    """
+    Return the MinHash signatures, an array of `num_perm` uint32 per title,
+    of the character shingles of the normalized titles. Titles shorter than
+    a shingle are a single shingle.
+    """
+    a, b = _permutations(num_perm, seed)
+    signatures = np.empty((len(titles), num_perm), dtype=np.uint32)
+
+    for start in range(0, len(titles), SIGNATURE_BLOCK_SIZE):
+        block = titles[start : start + SIGNATURE_BLOCK_SIZE]
+        shingles = (
+            pl.DataFrame({"title": block})
+            .with_row_index("row")
+            .with_columns(normalize_titles(pl.col("title").fill_null("")))
+            .with_columns(
+                pl.int_ranges(
+                    0,
+                    (
+                        pl.col("title").str.len_chars().cast(pl.Int64)
+                        - shingle_size
+                        + 1
+                    ).clip(lower_bound=1),
+                ).alias("offset")
+            )
+            .explode("offset")
+            .select(
+                "row",
+                pl.col("title")
+                .str.slice(pl.col("offset"), shingle_size)
+                .hash(seed)
+                .alias("shingle"),
+            )
+        )
+        # The shingles of each title are contiguous
+        starts = np.flatnonzero(np.diff(shingles["row"].to_numpy(), prepend=-1))
+        hashes = shingles["shingle"].to_numpy() >> np.uint64(32)
+
+        for i in range(num_perm):
+            values = ((a[i] * hashes + b[i]) >> np.uint64(32)).astype(np.uint32)
+            signatures[start : start + len(block), i] = np.minimum.reduceat(
+                values, starts
+            )
+
+    return signatures
+
+
+def band_hashes(signatures, bands):
+    """
+    Return the (titles, bands) hashes of the bands of rows of the signatures,
+    titles sharing the hash of any band are candidate matches.
+    """
+    rows = signatures.shape[1] // bands
+    banded = signatures[:, : bands * rows].reshape(len(signatures), bands, rows)
+
+    keys = np.zeros((len(signatures), bands), dtype=np.uint64)
+    for row in range(rows):
+        keys = (keys * FNV_PRIME) ^ banded[:, :, row].astype(np.uint64)
+
+    return keys
+
+
+def _bands_frame(keys, entities, entity_column):
+    bands = keys.shape[1]
+    return pl.DataFrame(
+        {
+            entity_column: np.repeat(entities, bands),
+            "band": np.tile(np.arange(bands, dtype=np.uint8), len(keys)),
+            "band_hash": keys.ravel(),
+        }
+    )
+
+
+def _index_lsh_chunk(sources, chunk_id, index_path, num_perm, bands, shingle_size):
+    df = pl.concat(
+        [
+            tokenize_meta_ids(
+                pl.scan_csv(
+                    source,
+                    schema_overrides={c: pl.String for c in TITLE_INDEX_COLUMNS},
+                )
+                .select(TITLE_INDEX_COLUMNS)
+                .drop_nulls("title"),
+                schemes=("doi",),
+            )
+            for source in sources
+        ]
+    ).collect()
+
+    # One signature per Meta entity, the entities are numbered across chunks
+    # by their chunk and position in it
+    entities_df = (
+        df.select("omid", "title")
+        .unique("omid", keep="first", maintain_order=True)
+        .with_row_index("entity")
+        .with_columns(
+            pl.col("entity").cast(pl.UInt64) + pl.lit(chunk_id << 32, pl.UInt64)
+        )
+    )
+    keys = band_hashes(
+        minhash_signatures(entities_df["title"], num_perm, shingle_size), bands
+    )
+
+    _bands_frame(keys, entities_df["entity"].to_numpy(), "entity").write_parquet(
+        index_path / "bands" / f"part-{chunk_id:05d}.parquet"
+    )
+    entities_df.join(
+        df.select("omid", "id", "type"), on="omid", how="inner", maintain_order="left"
+    ).write_parquet(index_path / "entities" / f"part-{chunk_id:05d}.parquet")
+
+
+def build_title_lsh(
+    meta_path,
+    index_path="data/meta_titles_lsh",
+    num_perm=32,
+    bands=8,
+    shingle_size=5,
+    chunk_size=100,
+    workers=1,
+):
+    """
+    Build a locality-sensitive hashing index of the titles of the Meta
+    entities with a DOI. The MinHash signature of the character shingles of
+    each title is split into `bands` bands, and titles sharing a band are
+    candidate matches.
+    """
+    index_path = Path(index_path)
+    if index_path.exists() and any(index_path.iterdir()):
+        raise FileExistsError(
+            f"Folder '{index_path}' already exists and is not empty. Please remove it or choose another path."
+        )
+    (index_path / "bands").mkdir(parents=True, exist_ok=True)
+    (index_path / "entities").mkdir(parents=True, exist_ok=True)
+
+    convert_meta_chunks(
+        meta_path,
+        _index_lsh_chunk,
+        (index_path, num_perm, bands, shingle_size),
+        chunk_size=chunk_size,
+        workers=workers,
+    )
+
+    with open(index_path / "meta_titles_lsh.json", "w") as f:
+        json.dump(
+            {
+                "num_perm": num_perm,
+                "bands": bands,
+                "shingle_size": shingle_size,
+                "polars_version": pl.__version__,
+            },
+            f,
+            indent=2,
+        )
+
+    print(f"Meta title LSH index saved to '{index_path}'")
+
+
+class TitleLSHIndex:
+    """
+    Query a Meta title LSH index created with `build_title_lsh`.
+    """
+
+    def __init__(self, index_path="data/meta_titles_lsh"):
+        self.index_path = Path(index_path)
+        metadata_path = self.index_path / "meta_titles_lsh.json"
+        if not metadata_path.exists():
+            raise FileNotFoundError(
+                f"Folder '{self.index_path}' is not a Meta title LSH index. Please create it with the 'create_title_index.py' script first."
+            )
+
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        # Polars only guarantees stable hashes within the same version
+        if metadata["polars_version"] != pl.__version__:
+            raise ValueError(
+                f"Meta title LSH index built with Polars {metadata['polars_version']}, "
+                "its shingle hashes can't be compared. Please build it again."
+            )
+        self.num_perm = metadata["num_perm"]
+        self.bands = metadata["bands"]
+        self.shingle_size = metadata["shingle_size"]
+
+    def _signatures(self, titles):
+        return minhash_signatures(titles, self.num_perm, self.shingle_size)
+
+    def query(self, titles_df, top_k=5, threshold=0.5, batch_size=20_000):
+        """
+        Return the `top_k` Meta candidates of each (ITEM_ID, TITLE) row of
+        `titles_df` whose estimated Jaccard similarity with the title is at
+        least `threshold`, with one row per DOI of each candidate. The titles
+        are queried `batch_size` at a time.
+        """
+        return pl.concat(
+            [
+                self._query_batch(titles_df.slice(start, batch_size), top_k, threshold)
+                for start in range(0, max(titles_df.height, 1), batch_size)
+            ]
+        )
+
+    def _query_batch(self, titles_df, top_k, threshold):
+        signatures = self._signatures(titles_df["TITLE"])
+        query_bands = _bands_frame(
+            band_hashes(signatures, self.bands), np.arange(titles_df.height), "query"
+        )
+
+        # A single streaming pass over the bands finds the candidates
+        candidates = (
+            pl.scan_parquet(self.index_path / "bands" / "*.parquet")
+            .join(query_bands.lazy(), on=["band", "band_hash"], how="inner")
+            .select("query", "entity")
+            .unique()
+            .collect(engine="streaming")
+        )
+
+        entities = (
+            pl.scan_parquet(self.index_path / "entities" / "*.parquet")
+            .join(candidates.select("entity").unique().lazy(), on="entity", how="semi")
+            .collect(engine="streaming")
+        )
+        titles = entities.unique("entity").select("entity", "title")
+        candidate_signatures = self._signatures(titles["title"])
+
+        # The Jaccard estimate is the share of equal MinHash values
+        candidates = candidates.join(
+            titles.with_row_index("position").select("entity", "position"),
+            on="entity",
+        )
+        jaccard = (
+            signatures[candidates["query"].to_numpy()]
+            == candidate_signatures[candidates["position"].to_numpy()]
+        ).mean(axis=1)
+
+        best = (
+            candidates.with_columns(pl.Series("jaccard", jaccard))
+            .filter(pl.col("jaccard") >= threshold)
+            .sort(["query", "jaccard", "entity"], descending=[False, True, False])
+            .group_by("query", maintain_order=True)
+            .head(top_k)
+        )
+
+        return (
+            best.join(
+                titles_df.with_row_index("query").with_columns(
+                    pl.col("query").cast(pl.Int64)
+                ),
+                on="query",
+            )
+            .join(entities, on="entity", maintain_order="left")
+            .select(
+                "ITEM_ID",
+                "TITLE",
+                "omid",
+                "id",
+                "type",
+                pl.col("title").alias("meta_title"),
+                "jaccard",
+            )
+        )
+
+
+def match_titles_fuzzy(
+    iris_path, index_path="data/meta_titles_lsh", top_k=5, threshold=0.5
+):
+    """
+    Match the titles of the IRIS entities with no ID with the Meta title LSH
+    index, keeping the `top_k` candidates of each entity above `threshold`.
+    """
+    output_dir = Path("data/iris_in_meta")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    matches = TitleLSHIndex(index_path).query(
+        get_noid_titles(iris_path), top_k=top_k, threshold=threshold
+    )
+
+    titles_df = (
+        matches.select(
+            pl.col("TITLE").alias("title"),
+            "omid",
+            "id",
+            "type",
+            pl.col("ITEM_ID").alias("iris_id"),
+            "meta_title",
+            "jaccard",
+        )
+        .cast(TITLES_SCHEMA)
+        .sort(
+            ["iris_id", "jaccard", "omid", "id"], descending=[False, True, False, False]
+        )
+    )
+
+    titles_df.write_parquet(output_dir / "titles_noid.parquet")
+
+    print(f"Titles No ID saved to '{output_dir}/titles_noid.parquet'")
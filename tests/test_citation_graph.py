@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+import pytest
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from citation_graph import CitationGraph, build_citation_graph
+from iris_in_meta import encode_omids
+
+
+def _write_datasets(tmp_path, encoded):
+    iim = pl.DataFrame(
+        {
+            "id": ["doi:10.1/a", "doi:10.1/b", "doi:10.1/c"],
+            "omid": ["omid:br/061", "omid:br/062", "omid:br/063"],
+            "iris_id": [1, 2, 3],
+        }
+    )
+    iii = pl.DataFrame(
+        {
+            "id": ["oci:1", "oci:2", "oci:3", "oci:4", "oci:5"],
+            "citing": [
+                "omid:br/061",
+                "omid:br/062",
+                "omid:br/069",
+                "omid:br/061",
+                "omid:br/065",
+            ],
+            "cited": [
+                "omid:br/062",
+                "omid:br/063",
+                "omid:br/061",
+                "omid:br/064",
+                "omid:br/062",
+            ],
+        }
+    )
+    if encoded:
+        iim = iim.with_columns(encode_omids(pl.col("omid")))
+        iii = iii.with_columns(encode_omids(pl.col("citing", "cited")))
+    # A title match, whose OMID is a string even in the encoded datasets
+    titles = pl.DataFrame(
+        {
+            "title": ["A title"],
+            "omid": ["omid:br/069"],
+            "id": ["doi:10.1/d"],
+            "type": ["journal article"],
+            "iris_id": [4],
+        }
+    )
+
+    (tmp_path / "iris_in_meta").mkdir()
+    (tmp_path / "iris_in_index").mkdir()
+    iim.write_parquet(tmp_path / "iris_in_meta" / "iris_in_meta.parquet")
+    titles.write_parquet(tmp_path / "iris_in_meta" / "titles_noid.parquet")
+    iii.write_parquet(tmp_path / "iris_in_index" / "iris_in_index.parquet")
+
+
+@pytest.mark.parametrize("encoded", [False, True])
+def test_build_citation_graph_ignores_titles_noid(tmp_path, encoded):
+    _write_datasets(tmp_path, encoded)
+    build_citation_graph(
+        iii_path=tmp_path / "iris_in_index",
+        iim_path=tmp_path / "iris_in_meta",
+        graph_path=tmp_path / "citation_graph",
+    )
+    graph = CitationGraph(tmp_path / "citation_graph")
+
+    # Only the citations between the OMIDs of iris_in_meta.parquet
+    citing, cited = graph.induced_subgraph()
+    assert len(citing) == 2
+    assert np.asarray(graph.item_ids).tolist() == [1, 2, 3]
+    assert graph.in_degree(["omid:br/061"]).tolist() == [1]
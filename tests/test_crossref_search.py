@@ -0,0 +1,87 @@
+import importlib
+import sys
+from pathlib import Path
+
+import polars as pl
+import pytest
+sys.path.append(
+    str(Path(__file__).resolve().parents[1] / "notebooks" / "WOOC25")
+)
+
+pytest.importorskip("requests_cache")
+
+
+@pytest.fixture
+def crossref_search(tmp_path, monkeypatch):
+    # The module logs to a file in the current directory
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("crossref_search")
+
+
+def _result(item_id):
+    return {
+        "item_id": item_id,
+        "matched_title": f'A "title", {item_id}\nwith a new line',
+        "doi": f"10.1/{item_id}",
+        "issn": None,
+        "ambiguous_match": item_id % 2 == 0,
+        "score": 90.5,
+    }
+
+
+def _search(writer, start, stop):
+    for position in range(start, stop):
+        writer.write(_result(position))
+        writer.processed(position, position)
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".jsonl", ".parquet"])
+def test_result_writer_resume(crossref_search, tmp_path, suffix):
+    output_file = tmp_path / f"results{suffix}"
+    writer = crossref_search.ResultWriter(output_file, flush_every=2)
+    _search(writer, 0, 5)
+    # The run stops before the last row is flushed
+    writer = crossref_search.ResultWriter(output_file, flush_every=2)
+    assert writer.checkpoint["position"] == 3
+    _search(writer, 4, 7)
+    writer.close()
+
+    read = {".csv": pl.read_csv, ".jsonl": pl.read_ndjson}.get(
+        suffix, pl.read_parquet
+    )
+    df = read(output_file)
+    assert df["item_id"].to_list() == list(range(7))
+    assert df["matched_title"][0] == _result(0)["matched_title"]
+
+
+@pytest.mark.parametrize("crash_before_replace", [True, False])
+def test_result_writer_merge_crash(
+    crossref_search, tmp_path, monkeypatch, crash_before_replace
+):
+    output_file = tmp_path / "results.parquet"
+    writer = crossref_search.ResultWriter(output_file, flush_every=2)
+    _search(writer, 0, 4)
+    writer.close()
+
+    writer = crossref_search.ResultWriter(output_file, flush_every=2)
+    _search(writer, 4, 8)
+    # The run stops right before or after the output is replaced by its
+    # merged parts
+    replace = crossref_search.os.replace
+
+    def crash(src, dst):
+        if Path(src) != writer.merged_path:
+            return replace(src, dst)
+        if not crash_before_replace:
+            replace(src, dst)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(crossref_search.os, "replace", crash)
+    with pytest.raises(KeyboardInterrupt):
+        writer.close()
+    monkeypatch.setattr(crossref_search.os, "replace", replace)
+
+    writer = crossref_search.ResultWriter(output_file, flush_every=2)
+    assert writer.checkpoint["position"] == 7
+    writer.close()
+    assert pl.read_parquet(output_file)["item_id"].to_list() == list(range(8))
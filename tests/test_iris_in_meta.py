@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+import polars as pl
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from iris_in_meta import decode_omids, encode_omids
+
+
+def test_encode_omids():
+    df = pl.DataFrame(
+        {
+            "omid": [
+                "omid:br/0612345",
+                "omid:br/06",
+                "omid:br/06x1",
+                "omid:ra/0612345",
+                "doi:10.1/abc",
+                None,
+            ]
+        }
+    )
+    encoded = df.select(encode_omids(pl.col("omid")))["omid"]
+
+    # The leading 1 keeps the leading zero of the digits
+    assert encoded.dtype == pl.Int64
+    assert encoded.to_list() == [10612345, 106, None, None, None, None]
+
+
+def test_decode_omids_round_trip():
+    omids = ["omid:br/0612345", "omid:br/06", "omid:br/0000", None]
+    df = pl.DataFrame({"omid": omids}).select(encode_omids(pl.col("omid")))
+
+    assert df.select(decode_omids(pl.col("omid")))["omid"].to_list() == omids
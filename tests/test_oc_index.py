@@ -0,0 +1,112 @@
+import sys
+from concurrent.futures import Future, wait
+from pathlib import Path
+
+import polars as pl
+import pytest
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+import oc_index
+from oc_index import _run_within_budget, parse_memory_size
+
+
+class _ManualExecutor:
+    """
+    Executor whose futures only finish when `finish_next` is called, in the
+    order they were submitted.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.in_flight = []
+
+    def submit(self, func, *args):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.in_flight.append(len(self.pending))
+        self.pending.append((future, func(*args)))
+        return future
+
+    def finish_next(self):
+        if self.pending:
+            future, result = self.pending.pop(0)
+            future.set_result(result)
+
+
+def test_run_within_budget_with_late_completions(monkeypatch):
+    executor = _ManualExecutor()
+
+    def racing_wait(futures, return_when):
+        executor.finish_next()
+        done = wait(futures, return_when=return_when)
+        # The next task finishes after the wait returned, while the results
+        # are being written
+        executor.finish_next()
+        return done
+
+    monkeypatch.setattr(oc_index, "wait", racing_wait)
+
+    written = []
+    tasks = [(100, lambda i: pl.DataFrame({"i": [i]}), i) for i in range(30)]
+    _run_within_budget(
+        executor,
+        tasks,
+        workers=2,
+        max_memory=250,
+        write=lambda df: written.append(df["i"].item()),
+        progress=lambda n: None,
+    )
+
+    assert written == list(range(30))
+    # The tasks finish two at a time, and the next two are started together
+    # as the memory of the written results is not counted anymore
+    assert executor.in_flight == [0, 1] * 15
+
+
+def test_run_within_budget_over_budget():
+    executor = _ManualExecutor()
+    written = []
+
+    def write(df):
+        written.append(df["i"].item())
+
+    # Each task alone is over budget, so they run one at a time
+    original_submit = executor.submit
+
+    def submit(func, *args):
+        future = original_submit(func, *args)
+        executor.finish_next()
+        return future
+
+    executor.submit = submit
+    _run_within_budget(
+        executor,
+        [(100, lambda i: pl.DataFrame({"i": [i]}), i) for i in range(5)],
+        workers=4,
+        max_memory=50,
+        write=write,
+        progress=lambda n: None,
+    )
+
+    assert written == list(range(5))
+    assert executor.in_flight == [0] * 5
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [
+        ("1024", 1024),
+        ("512M", 512 * 1024**2),
+        ("16g", 16 * 1024**3),
+        ("1.5K", 1536),
+        (" 2GB ", 2 * 1024**3),
+        (2048, 2048),
+    ],
+)
+def test_parse_memory_size(size, expected):
+    assert parse_memory_size(size) == expected
+
+
+def test_parse_memory_size_invalid():
+    with pytest.raises(ValueError):
+        parse_memory_size("lots")
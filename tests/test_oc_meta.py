@@ -0,0 +1,95 @@
+import json
+import sys
+from pathlib import Path
+
+import polars as pl
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from oc_meta import (
+    META_MANIFEST,
+    _append_manifest_record,
+    _manifest_record,
+    _open_meta_manifest,
+    tokenize_meta_ids,
+)
+
+
+def test_tokenize_meta_ids():
+    lf = pl.LazyFrame(
+        {
+            "id": [
+                "doi:10.1/a pmid:123 omid:br/061 isbn:978",
+                "omid:br/062 doi:10.1/b doi:10.1/c",
+                "issn:1234-5678 omid:br/063",
+                "doi:10.1/d",
+            ],
+            "title": ["A", "B", "C", "D"],
+        }
+    )
+    df = tokenize_meta_ids(lf, schemes=("doi", "pmid")).collect()
+
+    # Every identifier of an entity is kept, the OMID can be anywhere
+    assert df.rows() == [
+        ("doi:10.1/a", "A", "omid:br/061", "doi"),
+        ("pmid:123", "A", "omid:br/061", "pmid"),
+        ("doi:10.1/b", "B", "omid:br/062", "doi"),
+        ("doi:10.1/c", "B", "omid:br/062", "doi"),
+        ("doi:10.1/d", "D", None, "doi"),
+    ]
+
+
+def _write_manifest(members_dir, fingerprint):
+    records, manifest = _open_meta_manifest(members_dir, fingerprint)
+    with manifest:
+        _append_manifest_record(manifest, _manifest_record("a.csv", 10, 1, None, 0))
+        _append_manifest_record(
+            manifest, _manifest_record("b.csv", 20, 2, "b.parquet", 5)
+        )
+        # The run is killed while writing a record
+        manifest.write('{"member": "c.csv", "si')
+    (members_dir / "b.parquet").touch()
+    return records
+
+
+def test_manifest_resume(tmp_path):
+    assert _write_manifest(tmp_path, "iris-1") == {}
+
+    records, manifest = _open_meta_manifest(tmp_path, "iris-1", resume=True)
+    with manifest:
+        _append_manifest_record(manifest, _manifest_record("c.csv", 30, 3, None, 0))
+
+    assert set(records) == {"a.csv", "b.csv"}
+    assert records["b.csv"]["output"] == "b.parquet"
+    assert (tmp_path / "b.parquet").exists()
+    lines = (tmp_path / META_MANIFEST).read_text().splitlines()
+    assert json.loads(lines[0]) == {"iris_fingerprint": "iris-1"}
+    assert json.loads(lines[-1])["member"] == "c.csv"
+
+    records, manifest = _open_meta_manifest(tmp_path, "iris-1", resume=True)
+    manifest.close()
+    assert set(records) == {"a.csv", "b.csv", "c.csv"}
+
+
+def test_manifest_resume_other_iris_dump(tmp_path):
+    _write_manifest(tmp_path, "iris-1")
+
+    records, manifest = _open_meta_manifest(tmp_path, "iris-2", resume=True)
+    manifest.close()
+
+    # The members of the other dump are processed again
+    assert records == {}
+    assert not (tmp_path / "b.parquet").exists()
+    lines = (tmp_path / META_MANIFEST).read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [{"iris_fingerprint": "iris-2"}]
+
+
+def test_manifest_without_fingerprint(tmp_path):
+    # A manifest written before the fingerprint was recorded
+    (tmp_path / META_MANIFEST).write_text(
+        json.dumps(_manifest_record("a.csv", 10, 1, None, 0)) + "\n"
+    )
+
+    records, manifest = _open_meta_manifest(tmp_path, "iris-1", resume=True)
+    manifest.close()
+
+    assert records == {}
@@ -0,0 +1,62 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+import profiling
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    profile_dir = tmp_path / "profile"
+    profile_dir.mkdir()
+    monkeypatch.setenv(profiling.PROFILE_DIR_ENV, str(profile_dir))
+    monkeypatch.setenv(profiling.PROFILE_TOP_ENV, "1")
+    monkeypatch.setattr(profiling, "_stages", [])
+    monkeypatch.setattr(profiling, "_slowest", [])
+    return profile_dir
+
+
+def test_profile_member_disabled(monkeypatch):
+    monkeypatch.delenv(profiling.PROFILE_DIR_ENV, raising=False)
+
+    with profiling.profile_member("stage", "member") as profile:
+        with profile.phase("read"):
+            pass
+        profile.set(rows_in=1)
+
+    with profiling.profile_stage("stage"):
+        pass
+    assert profiling._stages == []
+
+
+def test_write_report(profile_dir, tmp_path):
+    with profiling.profile_stage("iris_in_meta"):
+        for member, rows in [("a.csv", 3), ("b.csv", 5)]:
+            with profiling.profile_member(
+                "iris_in_meta", member, bytes_read=100
+            ) as profile:
+                with profile.phase("filter"):
+                    sum(range(10_000 * rows))
+                profile.set(rows_in=rows, rows_out=1)
+
+    report_path = tmp_path / "profile.json"
+    profiling.write_report(report_path)
+    with open(report_path) as f:
+        report = json.load(f)
+
+    (stage,) = report["stages"]
+    assert stage["stage"] == "iris_in_meta"
+    assert stage["bytes_read"] == 200
+    assert stage["rows_in"] == 8
+    assert stage["rows_out"] == 2
+    assert [m["member"] for m in stage["members"]] == ["a.csv", "b.csv"]
+    assert all("filter" in m["phases"] for m in stage["members"])
+
+    # Only the pstats dump of the slowest member is kept
+    (slowest,) = report["slowest_members"]
+    assert Path(slowest["pstats"]).exists()
+    assert len(list((tmp_path / "profile_pstats").iterdir())) == 1
+    assert not profile_dir.exists()